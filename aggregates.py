@@ -0,0 +1,774 @@
+import base64
+import json
+import zlib
+
+import numpy as np
+import pandas as pd
+
+# bump when a table definition changes; stored tables are rebuilt once
+AGGREGATE_VERSION = 13
+
+HOUR_MS = 3600000
+DAY_MS = 86400000
+USFS_TAGS = ["usfs", "cusfs"]
+
+RESOLUTION_FREQ = {"hour": "h", "day": "D", "week": "W-MON", "month": "MS"}
+ROLLUP_LEVELS = ["day", "week", "month"]
+
+# metric -> (source frame, value column, row filter); counts are taken over the value column
+ROLLUP_METRICS = {
+    "theft": ("theft_raw", "amount", None),
+    "fill": ("fill_raw", "amount", None),
+    "theft_cev": ("theft_cev", "amount", None),
+    "fill_cev": ("fill_cev", "amount", None),
+    "theft_usfs": ("theft_raw", "amount", "usfs"),
+    "fill_usfs": ("fill_raw", "amount", "usfs"),
+    "theft_pv": ("theft_raw", "probable_variation_max", "pv"),
+    "fill_pv": ("fill_raw", "probable_variation_max", "pv"),
+    "low_fuel": ("low_fuel_raw", "vehicle_id", "count"),
+}
+ROLLUP_COLUMNS = ["metric", "bucket_ms", "value", "count"]
+
+# cube cells are summed in canonical liters so regions can be added together
+CUBE_DIMENSIONS = ["vehicle_type", "fuel_type", "manufacturer"]
+CUBE_SOURCES = {
+    ("theft", "DPL"): ("theft_raw", "spec_manufacturer"),
+    ("theft", "CEV"): ("theft_cev", "spec_manufacturer"),
+    ("fill", "DPL"): ("fill_raw", "manufacturer"),
+    ("fill", "CEV"): ("fill_cev", "manufacturer"),
+}
+CUBE_COLUMNS = ["metric", "segment", "bucket_ms", *CUBE_DIMENSIONS, "value", "count"]
+IGNORE_FLAGS = {"theft": "alert_fuel_theft_ignore", "fill": "alert_fuel_filling_ignore"}
+
+
+def choose_resolution(start_ms, end_ms):
+    days = (end_ms - start_ms) / DAY_MS
+    if days <= 2:
+        return "hour"
+    if days <= 92:
+        return "day"
+    if days <= 730:
+        return "week"
+    return "month"
+
+
+def bucket_starts(bucket_ms, level):
+    if level == "hour":
+        return bucket_ms // HOUR_MS * HOUR_MS
+    if level == "day":
+        return bucket_ms // DAY_MS * DAY_MS
+    period = "W-SUN" if level == "week" else "M"
+    starts = pd.to_datetime(bucket_ms, unit="ms").dt.to_period(period).dt.start_time
+    return starts.astype("int64") // 10**6
+
+
+def next_bucket_starts(bucket_ms, level):
+    if level in ("hour", "day"):
+        return bucket_ms + (HOUR_MS if level == "hour" else DAY_MS)
+    offset = pd.DateOffset(weeks=1) if level == "week" else pd.DateOffset(months=1)
+    ends = pd.to_datetime(bucket_ms.astype("int64"), unit="ms") + offset
+    return ends.astype("int64") // 10**6
+
+
+def usfs_mask(col):
+    return col.map(lambda x: isinstance(x, list) and any(v in USFS_TAGS for v in x)).to_numpy(dtype=bool)
+
+
+def hourly_rollup(frames):
+    parts = []
+
+    for metric, (source, value_col, row_filter) in ROLLUP_METRICS.items():
+        df = frames.get(source)
+        if df is None or df.empty or value_col not in df.columns or "time_ms" not in df.columns:
+            continue
+
+        if row_filter == "usfs":
+            if "usfs" not in df.columns:
+                continue
+            df = df[usfs_mask(df["usfs"])]
+        elif row_filter == "pv":
+            df = df[df[value_col].notna()]
+        if df.empty:
+            continue
+
+        buckets = df["time_ms"].to_numpy() // HOUR_MS * HOUR_MS
+        if row_filter == "count":
+            values = df[value_col].notna().astype("int64")
+        else:
+            values = df[value_col].astype("float64")
+
+        grouped = pd.DataFrame({"bucket_ms": buckets, "value": values.to_numpy(), "present": df[value_col].notna().to_numpy()})
+        grouped = grouped.groupby("bucket_ms", sort=True).agg(value=("value", "sum"), count=("present", "sum")).reset_index()
+        grouped.insert(0, "metric", metric)
+        parts.append(grouped)
+
+    if not parts:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+    return pd.concat(parts, ignore_index=True)[ROLLUP_COLUMNS]
+
+
+# vehicle timeline rows are spread over hash partitions so one lookup reads one small file
+VEHICLE_PARTITIONS = 64
+# built from the classified but unfiltered frames, so MCE, excluded-model and
+# closed-account events show up on a vehicle's timeline too
+VEHICLE_EVENT_SOURCES = [
+    ("theft", "Theft", "amount"),
+    ("fill", "Refill", "amount"),
+    ("low_fuel", "Low fuel", "fuel_level"),
+    ("data_loss", "Data loss", "loss_duration"),
+]
+VEHICLE_EVENT_COLUMNS = ["vehicle_id", "time_ms", "event", "segment", "value", "detail"]
+
+
+def vehicle_partitions(vehicle_ids):
+    return pd.util.hash_pandas_object(vehicle_ids.astype(str), index=False).to_numpy() % VEHICLE_PARTITIONS
+
+
+def event_segments(df):
+    if "is_dpl" not in df.columns:
+        return np.full(len(df), "", dtype=object)
+    flags = [df[col].fillna(False).to_numpy(dtype=bool) for col in ["is_dpl", "is_cev", "is_closed_account"]]
+    return np.select(flags, ["DPL", "CEV", "Closed"], default="Excluded").astype(object)
+
+
+def vehicle_events(frames):
+    parts = []
+
+    for source, event, value_col in VEHICLE_EVENT_SOURCES:
+        df = frames.get(source)
+        if df is None or df.empty or "vehicle_id" not in df.columns or "time_ms" not in df.columns:
+            continue
+
+        detail = pd.Series("", index=df.index, dtype=object)
+        if "data_loss_type" in df.columns:
+            detail = df["data_loss_type"].astype(object).fillna("")
+        for ignore_col in ["alert_fuel_theft_ignore", "alert_fuel_filling_ignore"]:
+            if ignore_col in df.columns:
+                detail = detail.mask(df[ignore_col].fillna(False).astype(bool), "Ignored")
+
+        parts.append(pd.DataFrame({
+            "vehicle_id": df["vehicle_id"].astype(str).to_numpy(),
+            "time_ms": df["time_ms"].to_numpy(),
+            "event": event,
+            "segment": event_segments(df),
+            "value": pd.to_numeric(df[value_col], errors="coerce").to_numpy() if value_col in df.columns else None,
+            "detail": detail.to_numpy(),
+        }))
+
+    if not parts:
+        return pd.DataFrame(columns=VEHICLE_EVENT_COLUMNS)
+    return pd.concat(parts, ignore_index=True).sort_values(["vehicle_id", "time_ms"], kind="stable")
+
+
+# an alert with a data-loss event on the same vehicle this close either side counts as loss-adjacent
+LOSS_TOLERANCE_MS = 30 * 60 * 1000
+LOSS_ADJACENCY_COLUMNS = ["metric", "segment", "bucket_ms", "alerts", "adjacent", "adjacent_ignored"]
+
+
+def attach_data_loss(alerts, data_loss, tolerance_ms=LOSS_TOLERANCE_MS):
+    out = alerts.assign(
+        loss_before_ms=pd.NA, loss_before_type=None, loss_after_ms=pd.NA, loss_after_type=None, loss_adjacent=False
+    )
+    if alerts.empty or data_loss is None or data_loss.empty:
+        return out
+
+    left = pd.DataFrame({
+        "row": range(len(alerts)),
+        "vehicle_id": alerts["vehicle_id"].astype(str).to_numpy(),
+        "time_ms": alerts["time_ms"].astype("int64").to_numpy(),
+    }).sort_values("time_ms", kind="stable")
+    loss_type = data_loss["data_loss_type"] if "data_loss_type" in data_loss.columns else pd.Series(None, index=data_loss.index)
+    right = pd.DataFrame({
+        "vehicle_id": data_loss["vehicle_id"].astype(str).to_numpy(),
+        "time_ms": data_loss["time_ms"].astype("int64").to_numpy(),
+        "loss_ms": data_loss["time_ms"].astype("int64").to_numpy(),
+        "loss_type": loss_type.to_numpy(),
+    }).sort_values("time_ms", kind="stable")
+
+    for direction in ["backward", "forward"]:
+        joined = pd.merge_asof(
+            left, right, on="time_ms", by="vehicle_id", direction=direction, tolerance=tolerance_ms
+        ).sort_values("row")
+        side = "before" if direction == "backward" else "after"
+        out[f"loss_{side}_ms"] = joined["loss_ms"].astype("Int64").to_numpy()
+        out[f"loss_{side}_type"] = joined["loss_type"].to_numpy()
+
+    out["loss_adjacent"] = (out["loss_before_ms"].notna() | out["loss_after_ms"].notna()).to_numpy(dtype=bool)
+    return out
+
+
+def loss_adjacency(frames):
+    parts = []
+    data_loss = frames.get("data_loss_raw")
+
+    for (metric, segment), (source, _) in CUBE_SOURCES.items():
+        df = frames.get(source)
+        if df is None or df.empty or "time_ms" not in df.columns:
+            continue
+
+        ignore_col = IGNORE_FLAGS[metric]
+        joined = attach_data_loss(df, data_loss)
+        ignored = joined[ignore_col].fillna(False).astype(bool) if ignore_col in joined.columns else False
+
+        counts = pd.DataFrame({
+            "bucket_ms": joined["time_ms"].to_numpy() // DAY_MS * DAY_MS,
+            "alerts": 1,
+            "adjacent": joined["loss_adjacent"].astype("int64").to_numpy(),
+            "adjacent_ignored": (joined["loss_adjacent"] & ignored).astype("int64").to_numpy(),
+        })
+        counts = counts.groupby("bucket_ms", sort=True).sum().reset_index()
+        counts.insert(0, "segment", segment)
+        counts.insert(0, "metric", metric)
+        parts.append(counts)
+
+    if not parts:
+        return pd.DataFrame(columns=LOSS_ADJACENCY_COLUMNS)
+    return pd.concat(parts, ignore_index=True)[LOSS_ADJACENCY_COLUMNS]
+
+
+NO_REASON = "No reason given"
+IGNORE_REASON_COLUMNS = ["metric", "segment", "bucket_ms", "reason", "count"]
+
+
+def reason_labels(col):
+    # one string per listed reason, indexed by the row position it came from;
+    # a bare dict would explode into its keys, so it is wrapped as a single item
+    values = col.to_numpy(dtype=object).copy()
+    for i in np.flatnonzero(col.map(type).eq(dict).to_numpy()):
+        values[i] = [values[i]]
+    reasons = pd.Series(values).explode()
+
+    labels = reasons.str.strip()
+    other = (labels.isna() & reasons.notna()).to_numpy()
+    if other.any():
+        labels[other] = [json.dumps(x, sort_keys=True, default=str) for x in reasons[other]]
+    return labels.replace("", np.nan).fillna(NO_REASON)
+
+
+def ignore_reason_counts(frames):
+    parts = []
+
+    for (metric, segment), (source, _) in CUBE_SOURCES.items():
+        df = frames.get(source)
+        flag = IGNORE_FLAGS[metric]
+        if df is None or df.empty or flag not in df.columns or "time_ms" not in df.columns:
+            continue
+
+        df = df[df[flag].fillna(False).astype(bool)]
+        if df.empty:
+            continue
+
+        buckets = df["time_ms"].to_numpy() // DAY_MS * DAY_MS
+        if "ignore_reasons" in df.columns:
+            reasons = reason_labels(df["ignore_reasons"])
+            buckets = buckets[reasons.index.to_numpy()]
+        else:
+            reasons = pd.Series(NO_REASON, index=range(len(df)))
+        counts = pd.DataFrame({"bucket_ms": buckets, "reason": reasons.to_numpy()})
+        counts = counts.groupby(["bucket_ms", "reason"], sort=True).size().rename("count").reset_index()
+        counts.insert(0, "segment", segment)
+        counts.insert(0, "metric", metric)
+        parts.append(counts)
+
+    if not parts:
+        return pd.DataFrame(columns=IGNORE_REASON_COLUMNS)
+    return pd.concat(parts, ignore_index=True)[IGNORE_REASON_COLUMNS]
+
+
+# HyperLogLog sketches: 2**11 registers give about 2.3% standard error per estimate
+HLL_PRECISION = 11
+HLL_REGISTERS = 1 << HLL_PRECISION
+DISTINCT_SOURCES = {
+    "theft": "theft_raw",
+    "theft_cev": "theft_cev",
+    "fill": "fill_raw",
+    "fill_cev": "fill_cev",
+    "low_fuel": "low_fuel_raw",
+    "data_loss": "data_loss_raw",
+}
+DISTINCT_KEYS = {"vehicle": "vehicle_id", "account": "account_id"}
+DISTINCT_COLUMNS = ["metric", "key", "bucket_ms", "sketch"]
+
+
+def bit_length(values):
+    length = np.zeros(len(values), dtype=np.uint64)
+    for shift in [32, 16, 8, 4, 2, 1]:
+        wide = values >= np.uint64(1 << shift)
+        length += wide * np.uint64(shift)
+        values = np.where(wide, values >> np.uint64(shift), values)
+    return length + (values > 0)
+
+
+def hll_registers(values):
+    registers = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+    if len(values) == 0:
+        return registers
+
+    hashes = pd.util.hash_pandas_object(pd.Series(values).astype(str), index=False).to_numpy()
+    tail_bits = 64 - HLL_PRECISION
+    index = (hashes >> np.uint64(tail_bits)).astype(np.int64)
+    tail = hashes & np.uint64((1 << tail_bits) - 1)
+    rank = (np.uint64(tail_bits + 1) - bit_length(tail)).astype(np.uint8)
+
+    np.maximum.at(registers, index, rank)
+    return registers
+
+
+def encode_sketch(registers):
+    return base64.b64encode(zlib.compress(registers.tobytes())).decode()
+
+
+def decode_sketch(sketch):
+    return np.frombuffer(zlib.decompress(base64.b64decode(sketch)), dtype=np.uint8)
+
+
+def merge_sketches(sketches):
+    registers = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+    for sketch in sketches:
+        registers = np.maximum(registers, decode_sketch(sketch))
+    return registers
+
+
+def hll_estimate(registers):
+    m = HLL_REGISTERS
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.power(2.0, -registers.astype(np.float64)))
+
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * np.log(m / zeros)
+    return int(round(estimate))
+
+
+def daily_distinct(frames):
+    rows = []
+
+    for metric, source in DISTINCT_SOURCES.items():
+        df = frames.get(source)
+        if df is None or df.empty or "time_ms" not in df.columns:
+            continue
+
+        days = df["time_ms"].to_numpy() // DAY_MS * DAY_MS
+        for key, id_col in DISTINCT_KEYS.items():
+            if id_col not in df.columns:
+                continue
+            ids = df[id_col].astype(str).to_numpy()
+            for day, positions in pd.Series(range(len(df))).groupby(days).groups.items():
+                rows.append([metric, key, int(day), encode_sketch(hll_registers(ids[positions]))])
+
+    if not rows:
+        return pd.DataFrame(columns=DISTINCT_COLUMNS)
+    return pd.DataFrame(rows, columns=DISTINCT_COLUMNS).sort_values(["metric", "key", "bucket_ms"], ignore_index=True)
+
+
+def distinct_count(tables, metrics, key):
+    sketches = [
+        sketch
+        for table in tables if table is not None and not table.empty
+        for sketch in table.loc[table["metric"].isin(metrics) & (table["key"] == key), "sketch"]
+    ]
+    return hll_estimate(merge_sketches(sketches))
+
+
+# DDSketch-style log buckets: every quantile is within 1% of the true value and
+# sketches merge by adding counts per bucket
+QUANTILE_ACCURACY = 0.01
+QUANTILE_GAMMA = (1 + QUANTILE_ACCURACY) / (1 - QUANTILE_ACCURACY)
+QUANTILES = [0.5, 0.9, 0.99]
+QUANTILE_METRICS = {
+    "theft": ("theft_raw", "amount"),
+    "fill": ("fill_raw", "amount"),
+    "theft_cev": ("theft_cev", "amount"),
+    "fill_cev": ("fill_cev", "amount"),
+    "theft_pv": ("theft_raw", "probable_variation_max"),
+    "fill_pv": ("fill_raw", "probable_variation_max"),
+}
+QUANTILE_COLUMNS = ["metric", "bucket_ms", "zeros", "bins", "counts"]
+
+
+def daily_quantile_sketches(frames):
+    parts = []
+
+    for metric, (source, value_col) in QUANTILE_METRICS.items():
+        df = frames.get(source)
+        if df is None or df.empty or value_col not in df.columns or "time_ms" not in df.columns:
+            continue
+
+        values = pd.to_numeric(df[value_col], errors="coerce").astype("float64")
+        present = values.notna().to_numpy()
+        values = values.to_numpy()[present]
+        if not len(values):
+            continue
+
+        positive = values > 0
+        cells = pd.DataFrame({
+            "bucket_ms": df["time_ms"].to_numpy()[present] // DAY_MS * DAY_MS,
+            "bin": np.ceil(np.log(np.where(positive, values, 1)) / np.log(QUANTILE_GAMMA)).astype("int64"),
+            "positive": positive,
+        })
+
+        zeros = (~cells["positive"]).groupby(cells["bucket_ms"], sort=True).sum().astype("int64").rename("zeros")
+        counts = cells[positive].groupby(["bucket_ms", "bin"], sort=True).size().rename("count").reset_index()
+        sketches = zeros.to_frame().join(counts.groupby("bucket_ms").agg(bins=("bin", list), counts=("count", list)))
+        for col in ["bins", "counts"]:
+            sketches[col] = sketches[col].map(lambda x: x if isinstance(x, list) else [])
+
+        sketches = sketches.reset_index()
+        sketches.insert(0, "metric", metric)
+        parts.append(sketches)
+
+    if not parts:
+        return pd.DataFrame(columns=QUANTILE_COLUMNS)
+    return pd.concat(parts, ignore_index=True)[QUANTILE_COLUMNS]
+
+
+def sketch_quantiles(zeros, bins, counts):
+    total = zeros + counts.sum()
+    if not total:
+        return [None] * len(QUANTILES)
+
+    order = np.argsort(bins)
+    bins, cumulative = bins[order], zeros + np.cumsum(counts[order])
+    out = []
+    for q in QUANTILES:
+        rank = q * (total - 1)
+        if rank < zeros:
+            out.append(0.0)
+            continue
+        i = bins[np.searchsorted(cumulative, rank, side="right")]
+        out.append(2 * QUANTILE_GAMMA**i / (QUANTILE_GAMMA + 1))
+    return out
+
+
+def quantile_series(table, metric, level, start_ms, end_ms):
+    columns = ["time", *[f"p{round(q * 100)}" for q in QUANTILES]]
+    if table is None or table.empty:
+        return pd.DataFrame(columns=columns)
+
+    table = slice_range(table[table["metric"] == metric], start_ms, end_ms)
+    if table.empty:
+        return pd.DataFrame(columns=columns)
+
+    # sketches are daily, so an hourly view is banded per day
+    level = "day" if level == "hour" else level
+    cells = table.assign(bucket_ms=bucket_starts(table["bucket_ms"], level))[["bucket_ms", "bins", "counts"]]
+    cells = cells.explode(["bins", "counts"]).dropna()
+    zeros = table.groupby(bucket_starts(table["bucket_ms"], level))["zeros"].sum()
+
+    rows = []
+    for bucket, total_zeros in zeros.items():
+        merged = cells[cells["bucket_ms"] == bucket].groupby("bins")["counts"].sum()
+        quantiles = sketch_quantiles(
+            int(total_zeros), merged.index.to_numpy(dtype="int64"), merged.to_numpy(dtype="int64")
+        )
+        rows.append([pd.to_datetime(bucket, unit="ms"), *quantiles])
+
+    return pd.DataFrame(rows, columns=columns)
+
+
+# theft alerts are scored against the same vehicle's alert history
+SCORE_SOURCES = {"DPL": "theft_raw", "CEV": "theft_cev"}
+SCORE_MIN_ALERTS = 5
+SCORE_Z_THRESHOLD = 3.5
+SCORE_COLUMNS = ["vehicle_id", "time_ms", "segment", "account_id", "amount", "capacity_share", "robust_z"]
+
+
+def theft_score_rows(frames):
+    parts = []
+
+    for segment, source in SCORE_SOURCES.items():
+        df = frames.get(source)
+        if df is None or df.empty or "amount" not in df.columns or "time_ms" not in df.columns:
+            continue
+
+        amount = pd.to_numeric(df["amount"], errors="coerce").astype("float64")
+        # fuel_capacity is in liters whatever unit the region displays amounts in
+        liters = pd.to_numeric(df["amount_liters"] if "amount_liters" in df.columns else df["amount"], errors="coerce")
+        capacity = pd.to_numeric(df["fuel_capacity"], errors="coerce") if "fuel_capacity" in df.columns else pd.Series(np.nan, index=df.index)
+        parts.append(pd.DataFrame({
+            "vehicle_id": df["vehicle_id"].astype(str).to_numpy(),
+            "time_ms": df["time_ms"].to_numpy(),
+            "segment": segment,
+            "account_id": df["account_id"].astype(str).to_numpy() if "account_id" in df.columns else None,
+            "amount": amount.to_numpy(),
+            "capacity_share": (liters / capacity.where(capacity > 0)).astype("float64").to_numpy(),
+            "robust_z": np.nan,
+        }))
+
+    if not parts:
+        return pd.DataFrame(columns=SCORE_COLUMNS)
+    return pd.concat(parts, ignore_index=True)[SCORE_COLUMNS]
+
+
+def robust_scores(alerts):
+    # modified z-score: 0.6745 * (x - median) / MAD, falling back to the mean absolute
+    # deviation when more than half of a vehicle's alerts share one amount
+    by_vehicle = alerts.groupby("vehicle_id", sort=False)["amount"]
+    median = by_vehicle.transform("median")
+    deviation = (alerts["amount"] - median).abs()
+
+    by_deviation = deviation.groupby(alerts["vehicle_id"], sort=False)
+    mad = by_deviation.transform("median")
+    mean_ad = by_deviation.transform("mean")
+
+    z = (0.6745 * (alerts["amount"] - median) / mad.where(mad > 0)).fillna(
+        (alerts["amount"] - median) / (1.2533 * mean_ad.where(mean_ad > 0))
+    )
+    z = z.fillna(0.0).where(by_vehicle.transform("count") >= SCORE_MIN_ALERTS)
+    return alerts.assign(robust_z=z.to_numpy())
+
+
+def suspicious_vehicles(scores, z_threshold=SCORE_Z_THRESHOLD):
+    columns = ["vehicle_id", "account_id", "alerts", "flagged", "max_z", "max_capacity_share", "amount"]
+    if scores is None or scores.empty:
+        return pd.DataFrame(columns=columns)
+
+    flagged = scores["robust_z"] >= z_threshold
+    ranked = scores.assign(flagged=flagged).groupby("vehicle_id", sort=False).agg(
+        account_id=("account_id", "first"),
+        alerts=("amount", "size"),
+        flagged=("flagged", "sum"),
+        max_z=("robust_z", "max"),
+        max_capacity_share=("capacity_share", "max"),
+        amount=("amount", "sum"),
+    ).reset_index()
+
+    ranked = ranked[ranked["flagged"] > 0]
+    return ranked.sort_values(["flagged", "max_z"], ascending=False, ignore_index=True)[columns]
+
+
+# per-day partial sums per vehicle and account; a leaderboard over any range sums these rows
+LEADER_SOURCES = {
+    ("theft", "DPL"): ("theft_raw", "amount"),
+    ("theft", "CEV"): ("theft_cev", "amount"),
+    ("fill", "DPL"): ("fill_raw", "amount"),
+    ("fill", "CEV"): ("fill_cev", "amount"),
+    ("low_fuel", ""): ("low_fuel_raw", None),
+    ("data_loss", ""): ("data_loss_raw", None),
+}
+LEADER_COLUMNS = ["metric", "segment", "key", "bucket_ms", "entity_id", "value", "count"]
+
+
+def daily_leader_partials(frames):
+    parts = []
+
+    for (metric, segment), (source, value_col) in LEADER_SOURCES.items():
+        df = frames.get(source)
+        if df is None or df.empty or "time_ms" not in df.columns:
+            continue
+
+        values = pd.to_numeric(df[value_col], errors="coerce").astype("float64") if value_col in df.columns else pd.Series(1.0, index=df.index)
+        for key, id_col in DISTINCT_KEYS.items():
+            if id_col not in df.columns:
+                continue
+            cells = pd.DataFrame({
+                "bucket_ms": df["time_ms"].to_numpy() // DAY_MS * DAY_MS,
+                "entity_id": df[id_col].astype(str).to_numpy(),
+                "value": values.to_numpy(),
+            })
+            cells = cells.groupby(["bucket_ms", "entity_id"], sort=True).agg(
+                value=("value", "sum"), count=("value", "size")
+            ).reset_index()
+            cells.insert(0, "key", key)
+            cells.insert(0, "segment", segment)
+            cells.insert(0, "metric", metric)
+            parts.append(cells)
+
+    if not parts:
+        return pd.DataFrame(columns=LEADER_COLUMNS)
+    return pd.concat(parts, ignore_index=True)[LEADER_COLUMNS]
+
+
+def top_n(partials, metric, key, n=10, segments=None):
+    columns = ["entity_id", "value", "count"]
+    if partials is None or partials.empty:
+        return pd.DataFrame(columns=columns)
+
+    mask = (partials["metric"] == metric) & (partials["key"] == key)
+    if segments:
+        mask &= partials["segment"].isin(segments) | (partials["segment"] == "")
+    totals = partials[mask].groupby("entity_id", sort=False)[["value", "count"]].sum()
+    return totals.nlargest(n, "value").reset_index()[columns]
+
+
+# per-day, per-hour cells in canonical liters; any range folds into a weekday x hour grid
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+HOUR_OF_WEEK_COLUMNS = ["metric", "segment", "bucket_ms", "hour", "value", "count"]
+
+
+def daily_hour_cells(frames):
+    parts = []
+
+    for (metric, segment), (source, value_col) in LEADER_SOURCES.items():
+        df = frames.get(source)
+        if df is None or df.empty or "time_ms" not in df.columns:
+            continue
+
+        if value_col in df.columns:
+            amount = df["amount_liters"] if "amount_liters" in df.columns else df[value_col]
+            values = pd.to_numeric(amount, errors="coerce").astype("float64")
+        else:
+            values = pd.Series(0.0, index=df.index)
+
+        time_ms = df["time_ms"].to_numpy()
+        cells = pd.DataFrame({
+            "bucket_ms": time_ms // DAY_MS * DAY_MS,
+            "hour": time_ms % DAY_MS // HOUR_MS,
+            "value": values.to_numpy(),
+        })
+        cells = cells.groupby(["bucket_ms", "hour"], sort=True).agg(
+            value=("value", "sum"), count=("value", "size")
+        ).reset_index()
+        cells.insert(0, "segment", segment)
+        cells.insert(0, "metric", metric)
+        parts.append(cells)
+
+    if not parts:
+        return pd.DataFrame(columns=HOUR_OF_WEEK_COLUMNS)
+    return pd.concat(parts, ignore_index=True)[HOUR_OF_WEEK_COLUMNS]
+
+
+def hour_of_week(cells, metric, measure="count", segments=None):
+    grid = pd.DataFrame(0.0, index=WEEKDAYS, columns=range(24))
+    if cells is None or cells.empty:
+        return grid
+
+    mask = cells["metric"] == metric
+    if segments:
+        mask &= cells["segment"].isin(segments) | (cells["segment"] == "")
+    cells = cells[mask]
+    if cells.empty:
+        return grid
+
+    weekday = pd.to_datetime(cells["bucket_ms"], unit="ms").dt.weekday.map(dict(enumerate(WEEKDAYS)))
+    folded = cells.groupby([weekday.to_numpy(), cells["hour"].to_numpy()])[measure].sum()
+    return grid.add(folded.unstack(fill_value=0), fill_value=0).reindex(index=WEEKDAYS, columns=range(24), fill_value=0)
+
+
+def dimension_values(df, col):
+    if col not in df.columns:
+        return "Unknown"
+    values = df[col].astype("object")
+    return values.where(values.notna() & (values != ""), "Unknown").astype(str).to_numpy()
+
+
+def daily_cube(frames):
+    parts = []
+
+    for (metric, segment), (source, manufacturer_col) in CUBE_SOURCES.items():
+        df = frames.get(source)
+        if df is None or df.empty or "amount" not in df.columns or "time_ms" not in df.columns:
+            continue
+
+        amount = df["amount_liters"] if "amount_liters" in df.columns else df["amount"]
+        cells = pd.DataFrame({
+            "bucket_ms": df["time_ms"].to_numpy() // DAY_MS * DAY_MS,
+            "vehicle_type": dimension_values(df, "vehicle_type"),
+            "fuel_type": dimension_values(df, "fuel_type"),
+            "manufacturer": dimension_values(df, manufacturer_col),
+            "value": amount.astype("float64").to_numpy(),
+        })
+        cells = cells.groupby(["bucket_ms", *CUBE_DIMENSIONS], sort=True).agg(
+            value=("value", "sum"), count=("value", "size")
+        ).reset_index()
+        cells.insert(0, "segment", segment)
+        cells.insert(0, "metric", metric)
+        parts.append(cells)
+
+    if not parts:
+        return pd.DataFrame(columns=CUBE_COLUMNS)
+    return pd.concat(parts, ignore_index=True)[CUBE_COLUMNS]
+
+
+def slice_cube(cube, by, filters=None):
+    if cube is None or cube.empty:
+        return pd.DataFrame(columns=[*by, "value", "count"])
+
+    mask = pd.Series(True, index=cube.index)
+    for col, allowed in (filters or {}).items():
+        if allowed:
+            mask &= cube[col].isin(allowed)
+    cube = cube[mask]
+
+    if not by:
+        return pd.DataFrame({"value": [cube["value"].sum()], "count": [cube["count"].sum()]})
+    return cube.groupby(by, sort=True, observed=True)[["value", "count"]].sum().reset_index()
+
+
+def coarsen(table, level):
+    if table is None or table.empty:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+
+    table = table.assign(bucket_ms=bucket_starts(table["bucket_ms"], level))
+    return table.groupby(["metric", "bucket_ms"], sort=True)[["value", "count"]].sum().reset_index()[ROLLUP_COLUMNS]
+
+
+def slice_range(table, start_ms, end_ms, key="bucket_ms"):
+    # every range is half-open, [start_ms, end_ms), the same rule replace_range writes with
+    if table is None or table.empty:
+        return table
+    return table[(table[key] >= start_ms) & (table[key] < end_ms)]
+
+
+def replace_range(table, fresh, start_ms, end_ms, key="bucket_ms"):
+    if table is None or table.empty:
+        return fresh.reset_index(drop=True)
+    keep = table[(table[key] < start_ms) | (table[key] >= end_ms)]
+    if fresh is None or fresh.empty:
+        return keep.reset_index(drop=True)
+    return pd.concat([keep, fresh], ignore_index=True).sort_values(key, kind="stable").reset_index(drop=True)
+
+
+# stored table -> builder over one region's classified frames; every table is keyed by bucket_ms
+AGGREGATE_BUILDERS = {
+    "rollup_hour": hourly_rollup,
+    "cube": daily_cube,
+    "loss_adjacency": loss_adjacency,
+    "ignore_reasons": ignore_reason_counts,
+    "distinct": daily_distinct,
+    "quantiles": daily_quantile_sketches,
+    "leaders": daily_leader_partials,
+    "hour_of_week": daily_hour_cells,
+}
+
+
+def rollup_series(tables, metric, level, start_ms, end_ms):
+    value_col = ROLLUP_METRICS[metric][1]
+    empty = pd.DataFrame(columns=["time", value_col, "moving average"])
+    hourly = tables.get("rollup_hour")
+    if hourly is None or hourly.empty:
+        return empty
+
+    hourly = slice_range(hourly[hourly["metric"] == metric], start_ms, end_ms)
+    if hourly.empty:
+        return empty
+
+    if level == "hour":
+        series = hourly[["bucket_ms", "value"]]
+    else:
+        # buckets lying wholly inside the range come from the stored level; the
+        # partial buckets at either edge are summed from the hourly rows in range
+        stored = tables.get(f"rollup_{level}")
+        inner = pd.DataFrame(columns=ROLLUP_COLUMNS)
+        if stored is not None and not stored.empty:
+            inner = stored[(stored["metric"] == metric) & (stored["bucket_ms"] >= start_ms)]
+            bucket_ends = next_bucket_starts(inner["bucket_ms"], level)
+            inner = inner[bucket_ends <= end_ms]
+
+        edges = hourly[~bucket_starts(hourly["bucket_ms"], level).isin(inner["bucket_ms"])]
+        parts = [part[["bucket_ms", "value"]] for part in (inner, coarsen(edges, level)) if not part.empty]
+        series = pd.concat(parts).groupby("bucket_ms", sort=True)["value"].sum().reset_index()
+
+    times = pd.to_datetime(series["bucket_ms"].astype("int64"), unit="ms")
+    values = pd.Series(series["value"].to_numpy(), index=times)
+    full = pd.date_range(times.min(), times.max(), freq=RESOLUTION_FREQ[level])
+    values = values.groupby(level=0).sum().reindex(full, fill_value=0)
+
+    if metric == "low_fuel":
+        values = values.astype("int64")
+
+    return pd.DataFrame({
+        "time": values.index,
+        value_col: values.to_numpy(),
+        "moving average": values.expanding().mean().to_numpy(),
+    })
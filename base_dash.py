@@ -54,11 +54,11 @@ def _inner_load_from(loader: ResourceLoader):
 
 
 class LoaderCache:
-    def __init__(self, cache_path: Optional[str] = None, compress: bool = True):
+    def __init__(self, cache_path: Optional[str] = None, compress: bool = True, verbose: int = 1):
         self._cache_path = cache_path or default_cache_path
         if self._cache_path and os.path.exists(self._cache_path):
             self._disable_caching = False
-            self._memory = Memory(self._cache_path, compress=compress)
+            self._memory = Memory(self._cache_path, compress=compress, verbose=verbose)
             self._inner_load_from = self._memory.cache(_inner_load_from)
         else:
             warnings.warn(
@@ -74,6 +74,11 @@ class LoaderCache:
             return loader.load()
         return self._inner_load_from(loader)
 
+    def reduce_size(self, bytes_limit: int):
+        if self._disable_caching:
+            return
+        self._memory.reduce_size(bytes_limit=bytes_limit)
+
 
 # -----------------------------
 # Loaders
@@ -0,0 +1,104 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import polars_backend
+from data_fetcher import (
+    MCE_TYPES,
+    EXCLUDED_MODELS,
+    normalize_alerts,
+    build_region_outputs,
+    build_daily_frames,
+)
+
+DAY_MS = 86400000
+VEHICLES = 20000
+
+
+def synthetic_alerts(dataset, days, rows_per_day, seed):
+    rng = np.random.default_rng(seed)
+    n = days * rows_per_day
+    end_ms = int(pd.Timestamp.now().normalize().timestamp() * 1000)
+    vehicle = rng.integers(0, VEHICLES, n)
+
+    df = pd.DataFrame({
+        "vehicle_id": (10**12 + vehicle).astype(str),
+        "account_id": (500 + vehicle % 800).astype(str),
+        "time": np.sort(rng.integers(end_ms - days * DAY_MS, end_ms, n)),
+    })
+
+    if dataset == "low_fuel":
+        df["id"] = [f"l{i}" for i in range(n)]
+        df["fuel_level"] = rng.random(n) * 10
+        df["type"] = "low"
+        return df
+
+    models = np.array(["m1", "m2", "m3"] + EXCLUDED_MODELS[:2], dtype=object)
+    types = np.array(["truck", "bus", "tanker"] + MCE_TYPES[:2], dtype=object)
+    df["amount"] = np.round(rng.random(n) * 150, 2)
+    df["probable_variation"] = np.where(rng.random(n) < 0.4, "{'max': 4.5}", None)
+    df["model"] = models[vehicle % len(models)]
+    df["vehicle_type"] = types[vehicle % len(types)]
+    df["account_stage"] = np.where(vehicle % 17 == 0, "closed", "live")
+    df["fuel_type"] = np.array(["diesel", "lng", "cng"], dtype=object)[vehicle % 3]
+    df["vehicle tags"] = [["usfs"] if v % 11 == 0 else [] for v in vehicle]
+    df["spec tags"] = [[] for _ in vehicle]
+    if dataset == "fill":
+        df["id"] = [f"f{i}" for i in range(n)]
+    return df
+
+
+def build_frames(days, rows_per_day):
+    frames = {
+        dataset: normalize_alerts(synthetic_alerts(dataset, days, rows_per_day, seed), dataset)
+        for seed, dataset in enumerate(["theft", "fill", "low_fuel"])
+    }
+    return build_region_outputs("IND", frames["theft"], frames["fill"], frames["low_fuel"], pd.DataFrame())
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the pandas and polars pipeline backends")
+    parser.add_argument("--rows-per-day", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if polars_backend.pl is None:
+        raise SystemExit("polars is not installed")
+
+    rows = []
+    for days in [10, 90]:
+        frames = build_frames(days, args.rows_per_day)
+        pandas_out, pandas_s = timed(lambda: build_daily_frames(frames), args.repeat)
+        polars_out, polars_s = timed(lambda: polars_backend.build_daily_frames(frames), args.repeat)
+
+        for key, expected in pandas_out.items():
+            pd.testing.assert_frame_equal(
+                expected.reset_index(drop=True), polars_out[key].reset_index(drop=True), rtol=1e-6
+            )
+
+        rows.append({
+            "Days": days,
+            "Rows": sum(len(frames[k]) for k in ["theft_raw", "fill_raw", "theft_cev", "fill_cev", "low_fuel_raw"]),
+            "pandas (s)": round(pandas_s, 3),
+            "polars (s)": round(polars_s, 3),
+            "Speedup": round(pandas_s / polars_s, 1) if polars_s else None,
+        })
+
+    print(pd.DataFrame(rows).to_string(index=False))
+    print("Outputs identical across backends")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,8 @@ from streamlit_autorefresh import st_autorefresh
 
 
 try:
-    from data_fetcher import REGIONS, run_region_cached,run_region_cached_with_range,get_api_errors, clear_api_errors 
+    from data_fetcher import REGIONS, run_region_cached,run_region_cached_with_range,get_api_errors, clear_api_errors, build_cross_region_totals, build_cross_region_distinct, vehicle_timeline
+    from aggregates import CUBE_DIMENSIONS, LOSS_TOLERANCE_MS, SCORE_MIN_ALERTS, SCORE_Z_THRESHOLD, hour_of_week, slice_cube, suspicious_vehicles, top_n
 except ImportError:
     st.error("Could not import 'data_fetcher.py'. Please ensure the file exists and is named correctly.")
     st.stop()
@@ -116,11 +117,8 @@ clear_api_errors()
 @st.cache_data(show_spinner=True, ttl=6 * 60 * 60)
 def load_all_regions(start_ms, end_ms):
 
-    from data_fetcher import run_region_cached_with_range
-    return {
-        region: run_region_cached_with_range(region, url, start_ms, end_ms)
-        for region, url in REGIONS.items()
-    }
+    from data_fetcher import load_all_regions_parallel, CHART_COLUMNS
+    return load_all_regions_parallel(start_ms, end_ms, columns=CHART_COLUMNS)
 
 with st.spinner("Fetching data from Dashboard APIs..."):
     RESULTS = load_all_regions(start_time_ms, end_time_ms)
@@ -137,15 +135,17 @@ with st.spinner("Fetching data from Dashboard APIs..."):
 @st.cache_data(show_spinner=True, ttl=6 * 60 * 60)
 def load_all_regions(start_ms, end_ms):
 
-    from data_fetcher import run_region_cached_with_range
-    return {
-        region: run_region_cached_with_range(region, url, start_ms, end_ms)
-        for region, url in REGIONS.items()
-    }
+    from data_fetcher import load_all_regions_parallel, CHART_COLUMNS
+    return load_all_regions_parallel(start_ms, end_ms, columns=CHART_COLUMNS)
 
 with st.spinner("Fetching data from Dashboard APIs..."):
     RESULTS = load_all_regions(start_time_ms, end_time_ms)
 
+@st.cache_data(show_spinner=True, ttl=6 * 60 * 60)
+def load_region_export(region, start_ms, end_ms):
+
+    return run_region_cached_with_range(region, REGIONS[region], start_ms, end_ms)
+
 def build_fuel_summary_values(fill_daily, theft_daily):
 
 
@@ -231,7 +231,61 @@ def build_tp_fp_table(
         round(tp_theft, 2),
         round(fp_theft, 2)
     ]
-def create_plot(df, title, unit):
+
+
+LOSS_CATEGORIES = [
+    "Refills near data loss",
+    "Refill data-loss-adjacent rate (%)",
+    "Refills near data loss ignored (%)",
+    "Thefts near data loss",
+    "Theft data-loss-adjacent rate (%)",
+    "Thefts near data loss ignored (%)"
+]
+
+
+def build_loss_adjacency_values(adjacency, segment):
+    values = []
+
+    for metric in ["fill", "theft"]:
+        rows = adjacency[(adjacency["metric"] == metric) & (adjacency["segment"] == segment)] if not adjacency.empty else adjacency
+        alerts = int(rows["alerts"].sum()) if not rows.empty else 0
+        adjacent = int(rows["adjacent"].sum()) if not rows.empty else 0
+        ignored = int(rows["adjacent_ignored"].sum()) if not rows.empty else 0
+
+        values += [
+            adjacent,
+            round(adjacent / alerts * 100, 2) if alerts else 0,
+            round(ignored / adjacent * 100, 2) if adjacent else 0
+        ]
+
+    return values
+
+
+def build_ignore_reason_table(reasons):
+    if reasons is None or reasons.empty:
+        return pd.DataFrame()
+
+    table = reasons.pivot_table(
+        index=["metric", "reason"], columns="segment", values="count", aggfunc="sum", fill_value=0
+    ).reindex(columns=["DPL", "CEV"], fill_value=0).reset_index()
+    table.columns.name = None
+
+    table["metric"] = table["metric"].map({"fill": "Refill", "theft": "Theft"})
+    table = table.rename(columns={"metric": "Alert", "reason": "Ignore reason", "CEV": "OFF HIGHWAY"})
+
+    return table.sort_values(["Alert", "DPL"], ascending=[True, False])
+
+
+RESOLUTION_AXIS = {
+    "hour": {"dtick": 3 * 3600000, "tickformat": "%b %d %H:%M", "label": "Hour"},
+    "day": {"dtick": 86400000, "tickformat": "%b %d\n%Y", "label": "Day"},
+    "week": {"dtick": 7 * 86400000, "tickformat": "%b %d\n%Y", "label": "Week"},
+    "month": {"dtick": "M1", "tickformat": "%b\n%Y", "label": "Month"},
+}
+
+
+def create_plot(df, title, unit, resolution="day"):
+    axis = RESOLUTION_AXIS[resolution]
     fig = go.Figure()
 
     df = df.copy()
@@ -270,7 +324,7 @@ def create_plot(df, title, unit):
             "text": (
                 f"<b style='font-size:30px'>{title}</b><br>"
                 f"<span style='font-size:26px'>"
-                f"Total: {total:.2f} | Avg/Day: {avg:.2f}"
+                f"Total: {total:.2f} | Avg/{axis['label']}: {avg:.2f}"
                 f"</span>"
             ),
             "x": 0.5,
@@ -284,8 +338,8 @@ def create_plot(df, title, unit):
             showgrid=True,
             gridcolor='lightgray',
             tickmode='linear',
-            dtick=86400000,  
-            tickformat='%b %d\n%Y',  
+            dtick=axis["dtick"],  
+            tickformat=axis["tickformat"],  
             tickangle=-45
         ),
         yaxis=dict(
@@ -303,7 +357,54 @@ def create_plot(df, title, unit):
     return fig
 
 
-def create_plot_usfs(df, title, unit):
+def create_plot_quantiles(df, title, unit, resolution="day"):
+    # daily sketches cannot be split by hour, so hourly ranges are banded per day
+    axis = RESOLUTION_AXIS["day" if resolution == "hour" else resolution]
+    fig = go.Figure()
+
+    for col, fill in [("p50", None), ("p90", None), ("p99", "tonexty")]:
+        fig.add_trace(go.Scatter(
+            x=df["time"], y=df[col],
+            mode="markers+lines" if col == "p50" else "lines",
+            name=col.upper(),
+            fill=fill,
+            line=dict(width=4 if col == "p50" else 2, dash=None if col == "p50" else "dot")
+        ))
+
+    fig.update_layout(
+        title={
+            "text": f"<b style='font-size:30px'>{title}</b>",
+            "x": 0.5,
+            "xanchor": "center"
+        },
+        xaxis_title="Date",
+        yaxis_title=unit,
+        xaxis=dict(
+            title_font=dict(size=26, color='black', family='Arial Black'),
+            tickfont=dict(size=17, color='black', family='Arial Black'),
+            showgrid=True,
+            gridcolor='lightgray',
+            tickmode='linear',
+            dtick=axis["dtick"],
+            tickformat=axis["tickformat"],
+            tickangle=-45
+        ),
+        yaxis=dict(
+            rangemode="tozero",
+            title_font=dict(size=26, color='black', family='Arial Black'),
+            tickfont=dict(size=17, color='black', family='Arial Black'),
+            showgrid=True,
+            gridcolor='lightgray'
+        ),
+        height=450,
+        margin=dict(t=100, b=40, l=60, r=60)
+    )
+
+    return fig
+
+
+def create_plot_usfs(df, title, unit, resolution="day"):
+    axis = RESOLUTION_AXIS[resolution]
     fig = go.Figure()
 
     df = df.copy()
@@ -342,7 +443,7 @@ def create_plot_usfs(df, title, unit):
             "text": (
                 f"<b style='font-size:30px'>{title}</b><br>"
                 f"<span style='font-size:26px'>"
-                f"Total: {total:.2f} | Avg/Day: {avg:.2f}"
+                f"Total: {total:.2f} | Avg/{axis['label']}: {avg:.2f}"
                 f"</span>"
             ),
             "x": 0.5,
@@ -356,8 +457,8 @@ def create_plot_usfs(df, title, unit):
             showgrid=True,
             gridcolor='lightgray',
             tickmode='linear',
-            dtick=86400000,  
-            tickformat='%b %d\n%Y',  
+            dtick=axis["dtick"],  
+            tickformat=axis["tickformat"],  
             tickangle=-45
         ),
         yaxis=dict(
@@ -375,7 +476,8 @@ def create_plot_usfs(df, title, unit):
     return fig
 
 
-def create_plot_low_fuel(df, title):
+def create_plot_low_fuel(df, title, resolution="day"):
+    axis = RESOLUTION_AXIS[resolution]
     fig = go.Figure()
 
     df = df.copy()
@@ -412,7 +514,7 @@ def create_plot_low_fuel(df, title):
             "text": (
                 f"<b style='font-size:30px'>{title}</b><br>"
                 f"<span style='font-size:26px'>"
-                f"Total: {total:.2f} | Avg/Day: {avg:.2f}"
+                f"Total: {total:.2f} | Avg/{axis['label']}: {avg:.2f}"
                 f"</span>"
             ),
             "x": 0.5,
@@ -426,8 +528,8 @@ def create_plot_low_fuel(df, title):
             showgrid=True,
             gridcolor='lightgray',
             tickmode='linear',
-            dtick=86400000,  
-            tickformat='%b %d\n%Y', 
+            dtick=axis["dtick"],  
+            tickformat=axis["tickformat"], 
             tickangle=-45
         ),
         yaxis=dict(
@@ -445,7 +547,8 @@ def create_plot_low_fuel(df, title):
     return fig
 
 
-def create_plot_pv(df, title, unit):
+def create_plot_pv(df, title, unit, resolution="day"):
+    axis = RESOLUTION_AXIS[resolution]
     fig = go.Figure()
 
     df = df.copy()
@@ -486,7 +589,7 @@ def create_plot_pv(df, title, unit):
             "text": (
                 f"<b style='font-size:30px'>{title}</b><br>"
                 f"<span style='font-size:26px'>"
-                f"Total: {total:.2f} | Avg/Day: {avg:.2f}"
+                f"Total: {total:.2f} | Avg/{axis['label']}: {avg:.2f}"
                 f"</span>"
             ),
             "x": 0.5,
@@ -500,8 +603,8 @@ def create_plot_pv(df, title, unit):
             showgrid=True,
             gridcolor='lightgray',
             tickmode='linear',
-            dtick=86400000,  
-            tickformat='%b %d\n%Y',  
+            dtick=axis["dtick"],  
+            tickformat=axis["tickformat"],  
             tickangle=-45
         ),
         yaxis=dict(
@@ -528,7 +631,12 @@ tabs = st.tabs([
     "FUEL SUMMARY",
     "DATA LOSS",
     "MAIN DASHBOARD",
-    "EXPORT DATA" 
+    "EXPORT DATA",
+    "BREAKDOWN",
+    "VEHICLE TIMELINE",
+    "SUSPICIOUS VEHICLES",
+    "LEADERBOARD",
+    "HEATMAP"
 ])
 
 UNIT_MAP = {
@@ -590,29 +698,32 @@ for tab, region in zip(tabs[:4], REGIONS.keys()):
         unit = UNIT_MAP[region]
 
 
-        fill_daily = RESULTS[region]["fill_daily"]
-        theft_daily = RESULTS[region]["theft_daily"]
+        series = RESULTS[region]["series"]
+        resolution = RESULTS[region]["resolution"]
+
+        fill_daily = series["fill"]
+        theft_daily = series["theft"]
         
 
-        fill_cev_daily = RESULTS[region]["fill_cev_daily"]
-        theft_cev_daily = RESULTS[region]["theft_cev_daily"]
+        fill_cev_daily = series["fill_cev"]
+        theft_cev_daily = series["theft_cev"]
         
-        fill_usfs = RESULTS[region]["fill_usfs_daily"]
-        theft_usfs = RESULTS[region]["theft_usfs_daily"]
-        fill_pv = RESULTS[region]["fill_pv_daily"]
-        theft_pv = RESULTS[region]["theft_pv_daily"]
-        low_fuel_daily = RESULTS[region]["low_fuel_daily"]
+        fill_usfs = series["fill_usfs"]
+        theft_usfs = series["theft_usfs"]
+        fill_pv = series["fill_pv"]
+        theft_pv = series["theft_pv"]
+        low_fuel_daily = series["low_fuel"]
 
 
         st.subheader("Fuel Refill (DPL)")
         if not fill_daily.empty:
-            st.plotly_chart(create_plot(fill_daily, f"{region} Refill (DPL)", unit), True)
+            st.plotly_chart(create_plot(fill_daily, f"{region} Refill (DPL)", unit, resolution), True)
         else:
             st.info("No refill data")
 
         st.subheader("Fuel Theft (DPL)")
         if not theft_daily.empty:
-            st.plotly_chart(create_plot(theft_daily, f"{region} Theft (DPL)", unit), True)
+            st.plotly_chart(create_plot(theft_daily, f"{region} Theft (DPL)", unit, resolution), True)
         else:
             st.info("No theft data")
 
@@ -620,13 +731,13 @@ for tab, region in zip(tabs[:4], REGIONS.keys()):
         st.markdown("---")
         st.subheader("Fuel Refill (CEV/Off-Highway)")
         if not fill_cev_daily.empty:
-            st.plotly_chart(create_plot(fill_cev_daily, f"{region} Refill (CEV)", unit), True)
+            st.plotly_chart(create_plot(fill_cev_daily, f"{region} Refill (CEV)", unit, resolution), True)
         else:
             st.info("No CEV refill data")
 
         st.subheader("Fuel Theft (CEV/Off-Highway)")
         if not theft_cev_daily.empty:
-            st.plotly_chart(create_plot(theft_cev_daily, f"{region} Theft (CEV)", unit), True)
+            st.plotly_chart(create_plot(theft_cev_daily, f"{region} Theft (CEV)", unit, resolution), True)
         else:
             st.info("No CEV theft data")
 
@@ -634,13 +745,13 @@ for tab, region in zip(tabs[:4], REGIONS.keys()):
         st.markdown("---")
         st.subheader("USFS Refill")
         if not fill_usfs.empty:
-            st.plotly_chart(create_plot_usfs(fill_usfs, f"{region} USFS Refill", unit), True)
+            st.plotly_chart(create_plot_usfs(fill_usfs, f"{region} USFS Refill", unit, resolution), True)
         else:
             st.info("No USFS refill data")
 
         st.subheader("USFS Theft")
         if not theft_usfs.empty:
-            st.plotly_chart(create_plot_usfs(theft_usfs, f"{region} USFS Theft", unit), True)
+            st.plotly_chart(create_plot_usfs(theft_usfs, f"{region} USFS Theft", unit, resolution), True)
         else:
             st.info("No USFS theft data")
 
@@ -648,22 +759,38 @@ for tab, region in zip(tabs[:4], REGIONS.keys()):
         st.markdown("---")
         st.subheader("Probable Variation – Refill")
         if not fill_pv.empty:
-            st.plotly_chart(create_plot_pv(fill_pv, f"{region} PV Refill", unit), True)
+            st.plotly_chart(create_plot_pv(fill_pv, f"{region} PV Refill", unit, resolution), True)
         else:
             st.info("No PV refill data")
 
         st.subheader("Probable Variation – Theft")
         if not theft_pv.empty:
-            st.plotly_chart(create_plot_pv(theft_pv, f"{region} PV Theft", unit), True)
+            st.plotly_chart(create_plot_pv(theft_pv, f"{region} PV Theft", unit, resolution), True)
         else:
             st.info("No PV theft data")
 
 
+        st.markdown("---")
+        quantiles = RESULTS[region]["quantiles"]
+        for metric, label in [
+            ("fill", "Refill Amount"), ("theft", "Theft Amount"),
+            ("fill_pv", "Probable Variation – Refill"), ("theft_pv", "Probable Variation – Theft")
+        ]:
+            st.subheader(f"{label} Percentiles (P50 / P90 / P99)")
+            if not quantiles[metric].empty:
+                st.plotly_chart(
+                    create_plot_quantiles(quantiles[metric], f"{region} {label} per Alert", unit, resolution),
+                    use_container_width=True
+                )
+            else:
+                st.info(f"No {label.lower()} data")
+
+
         st.markdown("---")
         st.subheader("Low Fuel Level Alerts")
         if not low_fuel_daily.empty:
             st.plotly_chart(
-                create_plot_low_fuel(low_fuel_daily, f"{region} Low Fuel Alerts"),
+                create_plot_low_fuel(low_fuel_daily, f"{region} Low Fuel Alerts", resolution),
                 use_container_width=True
             )
         else:
@@ -793,7 +920,51 @@ with tabs[4]:
             hide_index=True
         )
 
+        reason_df = build_ignore_reason_table(data["ignore_reasons"])
+
+        if not reason_df.empty:
+            st.dataframe(
+                reason_df,
+                use_container_width=True,
+                hide_index=True
+            )
+
+        loss_df = pd.DataFrame({
+            "Metric": LOSS_CATEGORIES,
+            "DPL": build_loss_adjacency_values(data["loss_adjacency"], "DPL"),
+            "OFF HIGHWAY": build_loss_adjacency_values(data["loss_adjacency"], "CEV")
+        })
+
+        st.caption(f"Alerts with a data loss event on the same vehicle within {LOSS_TOLERANCE_MS // 60000} minutes")
+        st.dataframe(
+            loss_df,
+            use_container_width=True,
+            hide_index=True
+        )
+
         st.markdown("---")
+
+    st.markdown(
+        "<h4 style='text-align:center;'> All Regions (liters)",
+        unsafe_allow_html=True
+    )
+
+    st.dataframe(
+        build_cross_region_totals(RESULTS),
+        use_container_width=True,
+        hide_index=True
+    )
+
+    st.markdown(
+        "<h4 style='text-align:center;'> Affected Vehicles and Accounts (approximate)",
+        unsafe_allow_html=True
+    )
+
+    st.dataframe(
+        build_cross_region_distinct(RESULTS),
+        use_container_width=True,
+        hide_index=True
+    )
 #-------
 
 # MAIN DASHBOARD tab
@@ -1461,6 +1632,8 @@ with tabs[7]:
         key="export_region_select"
     )
     
+    export_data = load_region_export(export_region, start_time_ms, end_time_ms)
+
     st.markdown("---")
     
 
@@ -1470,10 +1643,10 @@ with tabs[7]:
         st.subheader("🚛 DPL Data (On-Highway)")
         
 
-        if not RESULTS[export_region]["theft_raw"].empty:
-            theft_csv = RESULTS[export_region]["theft_raw"].to_csv(index=False)
+        if not export_data["theft_raw"].empty:
+            theft_csv = export_data["theft_raw"].to_csv(index=False)
             st.download_button(
-                label=f"📥 Download DPL Theft Alerts ({len(RESULTS[export_region]['theft_raw'])} records)",
+                label=f"📥 Download DPL Theft Alerts ({len(export_data['theft_raw'])} records)",
                 data=theft_csv,
                 file_name=f"{export_region}_DPL_Theft_{START_DATE}_{END_DATE}.csv",
                 mime="text/csv",
@@ -1483,10 +1656,10 @@ with tabs[7]:
             st.info("No DPL theft data available")
         
 
-        if not RESULTS[export_region]["fill_raw"].empty:
-            fill_csv = RESULTS[export_region]["fill_raw"].to_csv(index=False)
+        if not export_data["fill_raw"].empty:
+            fill_csv = export_data["fill_raw"].to_csv(index=False)
             st.download_button(
-                label=f"📥 Download DPL Filling Alerts ({len(RESULTS[export_region]['fill_raw'])} records)",
+                label=f"📥 Download DPL Filling Alerts ({len(export_data['fill_raw'])} records)",
                 data=fill_csv,
                 file_name=f"{export_region}_DPL_Filling_{START_DATE}_{END_DATE}.csv",
                 mime="text/csv",
@@ -1499,10 +1672,10 @@ with tabs[7]:
         st.subheader("🚜 CEV Data (Off-Highway)")
         
 
-        if not RESULTS[export_region]["theft_cev"].empty:
-            theft_cev_csv = RESULTS[export_region]["theft_cev"].to_csv(index=False)
+        if not export_data["theft_cev"].empty:
+            theft_cev_csv = export_data["theft_cev"].to_csv(index=False)
             st.download_button(
-                label=f"📥 Download CEV Theft Alerts ({len(RESULTS[export_region]['theft_cev'])} records)",
+                label=f"📥 Download CEV Theft Alerts ({len(export_data['theft_cev'])} records)",
                 data=theft_cev_csv,
                 file_name=f"{export_region}_CEV_Theft_{START_DATE}_{END_DATE}.csv",
                 mime="text/csv",
@@ -1512,10 +1685,10 @@ with tabs[7]:
             st.info("No CEV theft data available")
         
 
-        if not RESULTS[export_region]["fill_cev"].empty:
-            fill_cev_csv = RESULTS[export_region]["fill_cev"].to_csv(index=False)
+        if not export_data["fill_cev"].empty:
+            fill_cev_csv = export_data["fill_cev"].to_csv(index=False)
             st.download_button(
-                label=f"📥 Download CEV Filling Alerts ({len(RESULTS[export_region]['fill_cev'])} records)",
+                label=f"📥 Download CEV Filling Alerts ({len(export_data['fill_cev'])} records)",
                 data=fill_cev_csv,
                 file_name=f"{export_region}_CEV_Filling_{START_DATE}_{END_DATE}.csv",
                 mime="text/csv",
@@ -1533,9 +1706,9 @@ with tabs[7]:
     
     with col3:
 
-        pv_theft = RESULTS[export_region]["theft_raw"][
-            ~RESULTS[export_region]["theft_raw"]["probable_variation_max"].isna()
-        ] if "probable_variation_max" in RESULTS[export_region]["theft_raw"].columns else pd.DataFrame()
+        pv_theft = export_data["theft_raw"][
+            ~export_data["theft_raw"]["probable_variation_max"].isna()
+        ] if "probable_variation_max" in export_data["theft_raw"].columns else pd.DataFrame()
         
         if not pv_theft.empty:
             pv_theft_csv = pv_theft.to_csv(index=False)
@@ -1551,9 +1724,9 @@ with tabs[7]:
     
     with col4:
 
-        pv_fill = RESULTS[export_region]["fill_raw"][
-            ~RESULTS[export_region]["fill_raw"]["probable_variation_max"].isna()
-        ] if "probable_variation_max" in RESULTS[export_region]["fill_raw"].columns else pd.DataFrame()
+        pv_fill = export_data["fill_raw"][
+            ~export_data["fill_raw"]["probable_variation_max"].isna()
+        ] if "probable_variation_max" in export_data["fill_raw"].columns else pd.DataFrame()
         
         if not pv_fill.empty:
             pv_fill_csv = pv_fill.to_csv(index=False)
@@ -1576,11 +1749,11 @@ with tabs[7]:
     
     with col5:
 
-        usfs_theft = RESULTS[export_region]["theft_raw"][
-            RESULTS[export_region]["theft_raw"]["usfs"].apply(
+        usfs_theft = export_data["theft_raw"][
+            export_data["theft_raw"]["usfs"].apply(
                 lambda x: isinstance(x, list) and any(v in ["usfs", "cusfs"] for v in x) if x else False
             )
-        ] if "usfs" in RESULTS[export_region]["theft_raw"].columns and not RESULTS[export_region]["theft_raw"].empty else pd.DataFrame()
+        ] if "usfs" in export_data["theft_raw"].columns and not export_data["theft_raw"].empty else pd.DataFrame()
         
         if not usfs_theft.empty:
             usfs_theft_csv = usfs_theft.to_csv(index=False)
@@ -1596,11 +1769,11 @@ with tabs[7]:
     
     with col6:
 
-        usfs_fill = RESULTS[export_region]["fill_raw"][
-            RESULTS[export_region]["fill_raw"]["usfs"].apply(
+        usfs_fill = export_data["fill_raw"][
+            export_data["fill_raw"]["usfs"].apply(
                 lambda x: isinstance(x, list) and any(v in ["usfs", "cusfs"] for v in x) if x else False
             )
-        ] if "usfs" in RESULTS[export_region]["fill_raw"].columns and not RESULTS[export_region]["fill_raw"].empty else pd.DataFrame()
+        ] if "usfs" in export_data["fill_raw"].columns and not export_data["fill_raw"].empty else pd.DataFrame()
         
         if not usfs_fill.empty:
             usfs_fill_csv = usfs_fill.to_csv(index=False)
@@ -1623,10 +1796,10 @@ with tabs[7]:
     
     with col7:
 
-        if not RESULTS[export_region]["low_fuel_raw"].empty:
-            low_fuel_csv = RESULTS[export_region]["low_fuel_raw"].to_csv(index=False)
+        if not export_data["low_fuel_raw"].empty:
+            low_fuel_csv = export_data["low_fuel_raw"].to_csv(index=False)
             st.download_button(
-                label=f"📥 Download Low Fuel Alerts ({len(RESULTS[export_region]['low_fuel_raw'])} records)",
+                label=f"📥 Download Low Fuel Alerts ({len(export_data['low_fuel_raw'])} records)",
                 data=low_fuel_csv,
                 file_name=f"{export_region}_Low_Fuel_Alerts_{START_DATE}_{END_DATE}.csv",
                 mime="text/csv",
@@ -1637,10 +1810,10 @@ with tabs[7]:
     
     with col8:
 
-        if not RESULTS[export_region]["data_loss_raw"].empty:
-            data_loss_csv = RESULTS[export_region]["data_loss_raw"].to_csv(index=False)
+        if not export_data["data_loss_raw"].empty:
+            data_loss_csv = export_data["data_loss_raw"].to_csv(index=False)
             st.download_button(
-                label=f"📥 Download Data Loss Alerts ({len(RESULTS[export_region]['data_loss_raw'])} records)",
+                label=f"📥 Download Data Loss Alerts ({len(export_data['data_loss_raw'])} records)",
                 data=data_loss_csv,
                 file_name=f"{export_region}_Data_Loss_{START_DATE}_{END_DATE}.csv",
                 mime="text/csv",
@@ -1660,33 +1833,33 @@ with tabs[7]:
         all_data = []
         
 
-        if not RESULTS[export_region]["theft_raw"].empty:
-            df = RESULTS[export_region]["theft_raw"].copy()
+        if not export_data["theft_raw"].empty:
+            df = export_data["theft_raw"].copy()
             df["Data_Type"] = "DPL_Theft"
             all_data.append(df)
         
 
-        if not RESULTS[export_region]["fill_raw"].empty:
-            df = RESULTS[export_region]["fill_raw"].copy()
+        if not export_data["fill_raw"].empty:
+            df = export_data["fill_raw"].copy()
             df["Data_Type"] = "DPL_Filling"
             all_data.append(df)
         
 
-        if not RESULTS[export_region]["theft_cev"].empty:
-            df = RESULTS[export_region]["theft_cev"].copy()
+        if not export_data["theft_cev"].empty:
+            df = export_data["theft_cev"].copy()
             df["Data_Type"] = "CEV_Theft"
             all_data.append(df)
         
 
-        if not RESULTS[export_region]["fill_cev"].empty:
-            df = RESULTS[export_region]["fill_cev"].copy()
+        if not export_data["fill_cev"].empty:
+            df = export_data["fill_cev"].copy()
             df["Data_Type"] = "CEV_Filling"
             all_data.append(df)
         
 
-        pv_theft = RESULTS[export_region]["theft_raw"][
-            ~RESULTS[export_region]["theft_raw"]["probable_variation_max"].isna()
-        ] if "probable_variation_max" in RESULTS[export_region]["theft_raw"].columns else pd.DataFrame()
+        pv_theft = export_data["theft_raw"][
+            ~export_data["theft_raw"]["probable_variation_max"].isna()
+        ] if "probable_variation_max" in export_data["theft_raw"].columns else pd.DataFrame()
         
         if not pv_theft.empty:
             df = pv_theft.copy()
@@ -1694,9 +1867,9 @@ with tabs[7]:
             all_data.append(df)
         
 
-        pv_fill = RESULTS[export_region]["fill_raw"][
-            ~RESULTS[export_region]["fill_raw"]["probable_variation_max"].isna()
-        ] if "probable_variation_max" in RESULTS[export_region]["fill_raw"].columns else pd.DataFrame()
+        pv_fill = export_data["fill_raw"][
+            ~export_data["fill_raw"]["probable_variation_max"].isna()
+        ] if "probable_variation_max" in export_data["fill_raw"].columns else pd.DataFrame()
         
         if not pv_fill.empty:
             df = pv_fill.copy()
@@ -1704,9 +1877,9 @@ with tabs[7]:
             all_data.append(df)
         
 
-        if "usfs" in RESULTS[export_region]["theft_raw"].columns:
-            usfs_theft = RESULTS[export_region]["theft_raw"][
-                RESULTS[export_region]["theft_raw"]["usfs"].apply(
+        if "usfs" in export_data["theft_raw"].columns:
+            usfs_theft = export_data["theft_raw"][
+                export_data["theft_raw"]["usfs"].apply(
                     lambda x: isinstance(x, list) and any(v in ["usfs", "cusfs"] for v in x) if x else False
                 )
             ]
@@ -1716,9 +1889,9 @@ with tabs[7]:
                 all_data.append(df)
         
 
-        if "usfs" in RESULTS[export_region]["fill_raw"].columns:
-            usfs_fill = RESULTS[export_region]["fill_raw"][
-                RESULTS[export_region]["fill_raw"]["usfs"].apply(
+        if "usfs" in export_data["fill_raw"].columns:
+            usfs_fill = export_data["fill_raw"][
+                export_data["fill_raw"]["usfs"].apply(
                     lambda x: isinstance(x, list) and any(v in ["usfs", "cusfs"] for v in x) if x else False
                 )
             ]
@@ -1728,14 +1901,14 @@ with tabs[7]:
                 all_data.append(df)
         
 
-        if not RESULTS[export_region]["low_fuel_raw"].empty:
-            df = RESULTS[export_region]["low_fuel_raw"].copy()
+        if not export_data["low_fuel_raw"].empty:
+            df = export_data["low_fuel_raw"].copy()
             df["Data_Type"] = "Low_Fuel_Alert"
             all_data.append(df)
         
 
-        if not RESULTS[export_region]["data_loss_raw"].empty:
-            df = RESULTS[export_region]["data_loss_raw"].copy()
+        if not export_data["data_loss_raw"].empty:
+            df = export_data["data_loss_raw"].copy()
             df["Data_Type"] = "Data_Loss"
             all_data.append(df)
         
@@ -1763,4 +1936,333 @@ with tabs[7]:
         else:
             st.warning(f"No data available for {export_region} in the selected date range.")
 
+# BREAKDOWN tab
+
+CUBE_LABELS = {
+    "region": "Region",
+    "vehicle_type": "Vehicle type",
+    "fuel_type": "Fuel type",
+    "manufacturer": "Manufacturer",
+}
+
+with tabs[8]:
+    st.markdown(
+        "<h2 style='text-align:center;'>🧊 Theft & Refill Breakdown</h2>",
+        unsafe_allow_html=True
+    )
+
+    st.markdown("---")
+
+    cube = pd.concat(
+        [RESULTS[region]["cube"].assign(region=region) for region in REGIONS.keys()],
+        ignore_index=True
+    )
+
+    col1, col2, col3 = st.columns(3)
+
+    with col1:
+        cube_metric = st.selectbox(
+            "Alert type",
+            options=["theft", "fill"],
+            format_func=lambda x: "Theft" if x == "theft" else "Refill",
+            key="cube_metric"
+        )
+
+    with col2:
+        cube_segments = st.multiselect(
+            "Segment",
+            options=["DPL", "CEV"],
+            default=["DPL", "CEV"],
+            key="cube_segments"
+        )
+
+    with col3:
+        cube_by = st.multiselect(
+            "Break down by",
+            options=list(CUBE_LABELS),
+            default=["region", "vehicle_type"],
+            format_func=CUBE_LABELS.get,
+            key="cube_by"
+        )
+
+    cube_filters = {"metric": [cube_metric], "segment": cube_segments}
+
+    filter_cols = st.columns(len(CUBE_DIMENSIONS) + 1)
+    for col, dim in zip(filter_cols, ["region", *CUBE_DIMENSIONS]):
+        with col:
+            options = sorted(cube[dim].dropna().unique()) if not cube.empty else []
+            cube_filters[dim] = st.multiselect(CUBE_LABELS[dim], options=options, key=f"cube_filter_{dim}")
+
+    breakdown = slice_cube(cube, cube_by, cube_filters)
+
+    if breakdown.empty or breakdown["count"].sum() == 0:
+        st.info("No alerts match the selected slice")
+    else:
+        breakdown = breakdown.rename(
+            columns={**CUBE_LABELS, "value": "Amount (Liters)", "count": "Alerts"}
+        ).sort_values("Amount (Liters)", ascending=False)
+        breakdown["Amount (Liters)"] = breakdown["Amount (Liters)"].round(2)
+
+        if cube_by:
+            labels = breakdown[[CUBE_LABELS[c] for c in cube_by]].astype(str).agg(" / ".join, axis=1)
+            fig = go.Figure(go.Bar(x=labels, y=breakdown["Amount (Liters)"], text=breakdown["Alerts"]))
+            fig.update_layout(
+                yaxis_title="Liters",
+                height=450,
+                margin=dict(t=40, b=40, l=60, r=60)
+            )
+            st.plotly_chart(fig, use_container_width=True)
+
+        st.dataframe(
+            breakdown,
+            use_container_width=True,
+            hide_index=True
+        )
+
+with tabs[9]:
+    st.markdown(
+        "<h2 style='text-align:center;'>🚚 Vehicle Timeline</h2>",
+        unsafe_allow_html=True
+    )
+
+    st.markdown("---")
+
+    col1, col2 = st.columns([1, 3])
+
+    with col1:
+        timeline_region = st.selectbox("Region", options=list(REGIONS.keys()), key="timeline_region")
+
+    with col2:
+        timeline_vehicle = st.text_input("Vehicle ID", key="timeline_vehicle").strip()
+
+    if not timeline_vehicle:
+        st.info("Enter a vehicle ID to see its alerts in the selected date range")
+    else:
+        timeline = vehicle_timeline(timeline_region, timeline_vehicle, start_time_ms, end_time_ms)
+
+        if timeline.empty:
+            st.info("No alerts found for this vehicle in the selected date range")
+        else:
+            fig = go.Figure()
+            for event, rows in timeline.groupby("event", sort=False):
+                fig.add_trace(go.Scatter(
+                    x=rows["time"],
+                    y=[event] * len(rows),
+                    mode="markers",
+                    name=event,
+                    text=rows["value"].round(2).astype(str) + " " + rows["detail"].fillna(""),
+                    marker=dict(size=10)
+                ))
+            fig.update_layout(
+                height=350,
+                margin=dict(t=40, b=40, l=60, r=60)
+            )
+            st.plotly_chart(fig, use_container_width=True)
+
+            st.dataframe(
+                timeline.drop(columns="time_ms").rename(columns={
+                    "time": "Time", "event": "Event", "segment": "Segment",
+                    "value": "Value", "detail": "Detail"
+                }),
+                use_container_width=True,
+                hide_index=True
+            )
+
+with tabs[10]:
+    st.markdown(
+        "<h2 style='text-align:center;'>🚨 Suspicious Vehicles</h2>",
+        unsafe_allow_html=True
+    )
+
+    st.markdown("---")
+
+    col1, col2 = st.columns([1, 3])
+
+    with col1:
+        suspicious_region = st.selectbox("Region", options=list(REGIONS.keys()), key="suspicious_region")
+
+    with col2:
+        z_threshold = st.slider(
+            "Robust z-score threshold",
+            min_value=2.0,
+            max_value=10.0,
+            value=SCORE_Z_THRESHOLD,
+            step=0.5,
+            key="suspicious_threshold"
+        )
+
+    st.caption(
+        f"Theft alerts are scored against the same vehicle's alert history; "
+        f"vehicles with fewer than {SCORE_MIN_ALERTS} thefts are not scored"
+    )
+
+    suspicious = suspicious_vehicles(RESULTS[suspicious_region]["theft_scores"], z_threshold)
+
+    if suspicious.empty:
+        st.info("No theft alerts above the threshold in the selected date range")
+    else:
+        st.dataframe(
+            suspicious.round({"max_z": 2, "max_capacity_share": 3, "amount": 2}).rename(columns={
+                "vehicle_id": "Vehicle ID",
+                "account_id": "Account ID",
+                "alerts": "Theft alerts",
+                "flagged": "Outlier alerts",
+                "max_z": "Max robust z",
+                "max_capacity_share": "Max share of tank",
+                "amount": f"Total theft ({UNIT_MAP[suspicious_region]})"
+            }),
+            use_container_width=True,
+            hide_index=True
+        )
+
+LEADER_METRICS = {
+    "theft": "Theft amount",
+    "fill": "Refill amount",
+    "low_fuel": "Low fuel alerts",
+    "data_loss": "Data loss events",
+}
+
+with tabs[11]:
+    st.markdown(
+        "<h2 style='text-align:center;'>🏆 Top Vehicles & Accounts</h2>",
+        unsafe_allow_html=True
+    )
+
+    st.markdown("---")
+
+    col1, col2, col3, col4 = st.columns(4)
+
+    with col1:
+        leader_region = st.selectbox("Region", options=list(REGIONS.keys()), key="leader_region")
+
+    with col2:
+        leader_metric = st.selectbox(
+            "Rank by",
+            options=list(LEADER_METRICS),
+            format_func=LEADER_METRICS.get,
+            key="leader_metric"
+        )
+
+    with col3:
+        leader_key = st.radio(
+            "Rank",
+            options=["vehicle", "account"],
+            format_func=lambda x: "Vehicles" if x == "vehicle" else "Accounts",
+            horizontal=True,
+            key="leader_key"
+        )
+
+    with col4:
+        leader_n = st.slider("Top N", min_value=5, max_value=50, value=10, step=5, key="leader_n")
+
+    leader_segments = ["DPL", "CEV"]
+    if leader_metric in ("theft", "fill"):
+        leader_segments = st.multiselect(
+            "Segment",
+            options=["DPL", "CEV"],
+            default=["DPL", "CEV"],
+            key="leader_segments"
+        )
+
+    leaders = top_n(RESULTS[leader_region]["leaders"], leader_metric, leader_key, leader_n, leader_segments)
+
+    if leaders.empty:
+        st.info("No alerts in the selected date range")
+    else:
+        id_label = "Vehicle ID" if leader_key == "vehicle" else "Account ID"
+        if leader_metric in ("theft", "fill"):
+            leaders = leaders.rename(columns={
+                "entity_id": id_label,
+                "value": f"Amount ({UNIT_MAP[leader_region]})",
+                "count": "Alerts"
+            }).round(2)
+        else:
+            leaders = leaders.drop(columns="value").rename(columns={"entity_id": id_label, "count": "Alerts"})
+
+        fig = go.Figure(go.Bar(x=leaders[id_label].astype(str), y=leaders.iloc[:, 1]))
+        fig.update_layout(
+            xaxis_type="category",
+            yaxis_title=leaders.columns[1],
+            height=400,
+            margin=dict(t=40, b=40, l=60, r=60)
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
+        st.dataframe(
+            leaders,
+            use_container_width=True,
+            hide_index=True
+        )
+
+with tabs[12]:
+    st.markdown(
+        "<h2 style='text-align:center;'>🕒 Alerts by Hour of Week</h2>",
+        unsafe_allow_html=True
+    )
+
+    st.markdown("---")
+
+    col1, col2, col3, col4 = st.columns(4)
+
+    with col1:
+        heatmap_regions = st.multiselect(
+            "Regions",
+            options=list(REGIONS.keys()),
+            default=list(REGIONS.keys()),
+            key="heatmap_regions"
+        )
+
+    with col2:
+        heatmap_metric = st.selectbox(
+            "Alert type",
+            options=list(LEADER_METRICS),
+            format_func=lambda x: LEADER_METRICS[x].replace(" amount", ""),
+            key="heatmap_metric"
+        )
+
+    with col3:
+        heatmap_measure = "count"
+        if heatmap_metric in ("theft", "fill"):
+            heatmap_measure = st.radio(
+                "Measure",
+                options=["count", "value"],
+                format_func=lambda x: "Alerts" if x == "count" else "Amount (Liters)",
+                horizontal=True,
+                key="heatmap_measure"
+            )
+
+    with col4:
+        heatmap_segments = st.multiselect(
+            "Segment",
+            options=["DPL", "CEV"],
+            default=["DPL", "CEV"],
+            key="heatmap_segments"
+        )
+
+    cells = [RESULTS[region]["hour_of_week"] for region in heatmap_regions]
+    grid = hour_of_week(
+        pd.concat(cells, ignore_index=True) if cells else None,
+        heatmap_metric,
+        heatmap_measure,
+        heatmap_segments
+    )
+
+    if grid.to_numpy().sum() == 0:
+        st.info("No alerts for the selected regions and date range")
+    else:
+        fig = go.Figure(go.Heatmap(
+            z=grid.round(2).to_numpy(),
+            x=[f"{hour:02d}:00" for hour in grid.columns],
+            y=grid.index,
+            colorscale="Reds",
+            colorbar=dict(title="Alerts" if heatmap_measure == "count" else "Liters")
+        ))
+        fig.update_layout(
+            xaxis_title="Hour of day (UTC)",
+            yaxis=dict(autorange="reversed"),
+            height=450,
+            margin=dict(t=40, b=40, l=60, r=60)
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
 st.caption("© Intangles | Fuel Monitoring Dashboard")
\ No newline at end of file
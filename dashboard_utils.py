@@ -96,11 +96,8 @@ clear_api_errors()
 @st.cache_data(show_spinner=True, ttl=6 * 60 * 60)
 def load_all_regions(start_ms, end_ms):
 
-    from data_fetcher import run_region_cached_with_range
-    return {
-        region: run_region_cached_with_range(region, url, start_ms, end_ms)
-        for region, url in REGIONS.items()
-    }
+    from data_fetcher import load_all_regions_parallel, CHART_COLUMNS
+    return load_all_regions_parallel(start_ms, end_ms, columns=CHART_COLUMNS)
 
 with st.spinner("Fetching data from Dashboard APIs..."):
     RESULTS = load_all_regions(start_time_ms, end_time_ms)
@@ -117,11 +114,8 @@ with st.spinner("Fetching data from Dashboard APIs..."):
 @st.cache_data(show_spinner=True, ttl=6 * 60 * 60)
 def load_all_regions(start_ms, end_ms):
 
-    from data_fetcher import run_region_cached_with_range
-    return {
-        region: run_region_cached_with_range(region, url, start_ms, end_ms)
-        for region, url in REGIONS.items()
-    }
+    from data_fetcher import load_all_regions_parallel, CHART_COLUMNS
+    return load_all_regions_parallel(start_ms, end_ms, columns=CHART_COLUMNS)
 
 with st.spinner("Fetching data from Dashboard APIs..."):
     RESULTS = load_all_regions(start_time_ms, end_time_ms)
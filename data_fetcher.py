@@ -1,13 +1,38 @@
+import os
 import json
 import ast
+import hashlib
+import shutil
+import fcntl
+import argparse
 import requests
+import multiprocessing
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import aggregates
+from base_dash import LoaderCache, ResourceLoader
 from pathlib import Path
+from contextlib import contextmanager
 from datetime import timedelta
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 BASE_DIR = Path(__file__).resolve().parent
 CACHE_DIR = BASE_DIR / "cache_data"
 WINDOW_DAYS = 10
+# bump whenever the on-disk layout changes; the hot tier and aggregates of older stores are rebuilt once
+STORE_VERSION = 4
+# history segments, dimensions and backfill progress survive a STORE_VERSION change
+KEPT_ON_RESET = {"history", "dimensions.jsonl", "backfill_progress.jsonl", ".lock"}
+# windows ending this long ago no longer change upstream and their responses are kept on disk
+CLOSED_WINDOW_LAG_MS = 2 * 86400 * 1000
+RESPONSE_CACHE_BYTES = 2 * 1024**3
+BACKFILL_WORKERS = 8
+# compacted tiers are parquet so a projected read only decodes the columns it asks for;
+# rows older than WINDOW_DAYS move from the hot store into monthly segments under history/
+HOT_COMPRESSION = {"compression": "snappy"}
+COLD_COMPRESSION = {"compression": "zstd", "compression_level": 9}
 
 API_ERRORS = []
 
@@ -18,7 +43,7 @@ def clear_api_errors():
     global API_ERRORS
     API_ERRORS = []
 
-class DashboardQueryLoader:
+class DashboardQueryLoader(ResourceLoader):
     def __init__(self, url, query):
         self.url = url
         self.query = query
@@ -33,6 +58,20 @@ class DashboardQueryLoader:
         response.raise_for_status()
         return response.json()
 
+    def load(self):
+        return self.fetch()
+
+
+def fetch_query(url, query, cache=None):
+    loader = DashboardQueryLoader(url, query)
+    return cache.load_from(loader) if cache is not None else loader.fetch()
+
+
+def response_cache():
+    path = CACHE_DIR / "responses"
+    path.mkdir(parents=True, exist_ok=True)
+    return LoaderCache(str(path), verbose=0)
+
 
 REGIONS = {
     "IND": "http://internal-apis.intangles.com/dashboard_apis/fetch",
@@ -44,8 +83,28 @@ REGIONS = {
 
 BATCH_SIZE_MS = 2 * 3600 * 1000
 MAX_WORKERS = 30
+POOL_WORKERS = min(len(REGIONS), os.cpu_count() or 1)
+# spawn rather than fork: the Streamlit server process is multi-threaded
+POOL_START_METHOD = "spawn"
+
+# regions whose theft/fill queries return event fields only, joined locally
+# against the cached vehicle/spec/account dimensions
+SLIM_QUERY_REGIONS = {
+    "IND": False,
+    "NASA": False,
+    "EU": False,
+    "FML": False
+}
+DIMENSION_REFRESH_MS = 24 * 3600 * 1000
+DIMENSION_BATCH_SIZE = 500
 GALLON_CONVERSION = 0.264172
 
+# the store keeps API units (liters); these map a region's amounts to its display unit
+UNIT_PROJECTIONS = {
+    "NASA": {"scale": GALLON_CONVERSION},
+    "FML": {"source": "amount_in_kgs"},
+}
+
 MCE_TYPES = [  'yard_hauler','yard_loader','excavator', 'boom_pump', 'motor_grader',
        'backhoe_loader', 'earth_mover', 'construction_equipment','trommel_machine', 'track_loader', 'soil_compactor', 'horizontal_grinder', 'diesel_forklift',
        'rig_cowl','harvester' ]
@@ -62,62 +121,127 @@ EXCLUDED_MODELS = [
     "2523C 6x4 transit mixer  BS3 pto"
 ]
 
-def run_region_cached_with_range(region, url, start_ms, end_ms):
+CATEGORY_COLUMNS = [
+    "vehicle_type", "model", "fuel_type", "account_stage", "spec_manufacturer",
+    "manufacturer", "emission_standard", "account_name", "type", "data_loss_type"
+]
+ID_COLUMNS = ["id", "vehicle_id", "account_id", "spec_id"]
+FLOAT32_COLUMNS = [
+    "amount", "amount_in_kgs", "Amount_kgs", "probable_variation_max",
+    "fuel_capacity", "max_load_capacity", "fuel_level"
+]
+FLOAT32_TOLERANCE = 1e-3
+
+MCE_TYPE_SET = frozenset(MCE_TYPES)
+EXCLUDED_MODEL_SET = frozenset(EXCLUDED_MODELS)
+CLOSED_STAGE_SET = frozenset(["closed"])
+RULE_COLUMNS = ["vehicle_type", "model", "account_stage"]
 
-    all_data = run_region_cached(region, url)
+# what the charts and summaries read from the store; the export tab loads full rows
+ALERT_CHART_COLUMNS = [
+    "time", "time_ms", "vehicle_id", "account_id", "amount", "probable_variation_max", "usfs",
+    "vehicle_type", "model", "account_stage", "fuel_type"
+]
+CHART_COLUMNS = {
+    "theft": [
+        *ALERT_CHART_COLUMNS, "amount_in_kgs", "spec_manufacturer", "alert_fuel_theft_ignore", "ignore_reasons",
+        "fuel_capacity"
+    ],
+    "fill": [*ALERT_CHART_COLUMNS, "id", "Amount_kgs", "manufacturer", "alert_fuel_filling_ignore", "ignore_reasons"],
+    "low_fuel": ["id", "time", "time_ms", "vehicle_id", "account_id", "fuel_level", *RULE_COLUMNS],
+    "data_loss": ["time", "time_ms", "vehicle_id", "account_id", "data_loss_type", "loss_duration", *RULE_COLUMNS],
+}
+
+
+# stored tables handed to the dashboard as-is, cut to the selected range
+RANGE_TABLES = {
+    "cube": aggregates.CUBE_COLUMNS,
+    "hour_of_week": aggregates.HOUR_OF_WEEK_COLUMNS,
+    "leaders": aggregates.LEADER_COLUMNS,
+    "distinct": aggregates.DISTINCT_COLUMNS,
+    "ignore_reasons": aggregates.IGNORE_REASON_COLUMNS,
+    "loss_adjacency": aggregates.LOSS_ADJACENCY_COLUMNS,
+}
+
+
+def run_region_cached_with_range(region, url, start_ms, end_ms, columns=None):
+
+    all_data = run_region_cached(region, url, columns, history_start_ms=start_ms)
     
 
     filtered_data = {}
     
     for key, df in all_data.items():
-        if df is None or (isinstance(df, pd.DataFrame) and df.empty):
-            filtered_data[key] = df
-            continue
-        if isinstance(df, pd.DataFrame) and 'time_ms' in df.columns:
-            filtered_data[key] = df[
-                (df['time_ms'] >= start_ms) & 
-                (df['time_ms'] <= end_ms)
-            ].copy()
-            if key == "theft_daily":
-                filtered_data[key] = build_daily_df(filtered_data["theft_raw"])
-            elif key == "fill_daily":
-                filtered_data[key] = build_daily_df(filtered_data["fill_raw"])
-
-            elif key == "theft_cev_daily":
-                filtered_data[key] = build_daily_df(filtered_data["theft_cev"])
-            elif key == "fill_cev_daily":
-                filtered_data[key] = build_daily_df(filtered_data["fill_cev"])
-
-            elif key == "low_fuel_daily":
-                filtered_data[key] = build_daily_alert_count_df(filtered_data["low_fuel_raw"])
-            elif key == "theft_usfs_daily":
-                usfs_theft = filtered_data["theft_raw"][
-                    filtered_data["theft_raw"]["usfs"].apply(contains_usfs)
-                ] if "usfs" in filtered_data["theft_raw"].columns else pd.DataFrame()
-                filtered_data[key] = build_daily_amount_df(usfs_theft)
-            elif key == "fill_usfs_daily":
-                usfs_fill = filtered_data["fill_raw"][
-                    filtered_data["fill_raw"]["usfs"].apply(contains_usfs)
-                ] if "usfs" in filtered_data["fill_raw"].columns else pd.DataFrame()
-                filtered_data[key] = build_daily_amount_df(usfs_fill)
-            elif key == "theft_pv_daily":
-                filtered_data[key] = build_daily_pv_df(
-                    filtered_data["theft_raw"][~filtered_data["theft_raw"]["probable_variation_max"].isna()]
-                    if "probable_variation_max" in filtered_data["theft_raw"].columns else pd.DataFrame()
-                )
-            elif key == "fill_pv_daily":
-                filtered_data[key] = build_daily_pv_df(
-                    filtered_data["fill_raw"][~filtered_data["fill_raw"]["probable_variation_max"].isna()]
-                    if "probable_variation_max" in filtered_data["fill_raw"].columns else pd.DataFrame()
-                )
-            elif key == "data_loss_summary":
-                filtered_data[key] = build_data_loss_summary(filtered_data["data_loss_raw"])
+        if isinstance(df, pd.DataFrame) and not df.empty and 'time_ms' in df.columns:
+            filtered_data[key] = aggregates.slice_range(df, start_ms, end_ms, "time_ms").copy()
         else:
             filtered_data[key] = df
+
+    filtered_data["data_loss_summary"] = build_data_loss_summary(filtered_data["data_loss_raw"])
+
+    # every chart series, the daily ones included, comes from the stored rollups
+    tables = load_aggregate_tables(region)
+    filtered_data.update({
+        f"{metric}_daily": aggregates.rollup_series(tables, metric, "day", start_ms, end_ms)
+        for metric in aggregates.ROLLUP_METRICS
+    })
+    resolution = aggregates.choose_resolution(start_ms, end_ms)
+    filtered_data["resolution"] = resolution
+    filtered_data["series"] = {
+        metric: aggregates.rollup_series(tables, metric, resolution, start_ms, end_ms)
+        for metric in aggregates.ROLLUP_METRICS
+    }
+    filtered_data["quantiles"] = {
+        metric: aggregates.quantile_series(tables.get("quantiles"), metric, resolution, start_ms, end_ms)
+        for metric in aggregates.QUANTILE_METRICS
+    }
+    for name, table_columns in RANGE_TABLES.items():
+        table = tables.get(name, pd.DataFrame(columns=table_columns))
+        filtered_data[name] = aggregates.slice_range(table, start_ms, end_ms)
+
+    scores = load_theft_scores(region)
+    filtered_data["theft_scores"] = aggregates.slice_range(scores, start_ms, end_ms, "time_ms")
+
+    # full-width loads feed the export, which lists each alert's nearest data-loss events
+    # and the theft anomaly scores
+    if columns is None:
+        for key in ["theft_raw", "fill_raw", "theft_cev", "fill_cev"]:
+            filtered_data[key] = aggregates.attach_data_loss(filtered_data[key], all_data["data_loss_raw"])
+        for key in ["theft_raw", "theft_cev"]:
+            filtered_data[key] = attach_theft_scores(filtered_data[key], filtered_data["theft_scores"])
     
     return filtered_data
 
 
+def _region_worker(region, url, start_ms, end_ms, columns):
+    clear_api_errors()
+    data = run_region_cached_with_range(region, url, start_ms, end_ms, columns)
+    return data, get_api_errors()
+
+
+def load_all_regions_parallel(start_ms, end_ms, regions=None, columns=None):
+    regions = regions or REGIONS
+    results = {}
+
+    try:
+        context = multiprocessing.get_context(POOL_START_METHOD)
+        with ProcessPoolExecutor(max_workers=POOL_WORKERS, mp_context=context) as ex:
+            futures = {
+                ex.submit(_region_worker, region, url, start_ms, end_ms, columns): region
+                for region, url in regions.items()
+            }
+            for fut in as_completed(futures):
+                data, errors = fut.result()
+                results[futures[fut]] = data
+                API_ERRORS.extend(errors)
+    except (BrokenProcessPool, OSError) as err:
+        print(f" Process pool unavailable, processing regions serially: {err}")
+
+    for region, url in regions.items():
+        if region not in results:
+            results[region] = run_region_cached_with_range(region, url, start_ms, end_ms, columns)
+
+    return {region: results[region] for region in regions}
 
 
 def safe_parse_variation(x):
@@ -131,20 +255,162 @@ def safe_parse_variation(x):
     return None
 
 
+def to_category(col):
+    if isinstance(col.dtype, pd.CategoricalDtype) or not col.notna().any():
+        return col
+    if not (pd.api.types.is_object_dtype(col) or pd.api.types.is_string_dtype(col)):
+        return col
+    try:
+        return col.astype("category")
+    except TypeError:
+        return col
+
+
+def id_text(value):
+    if pd.isna(value):
+        return None
+    # a float id only comes from a column that held nulls; its integer part is the id
+    if isinstance(value, float):
+        value = int(value)
+    return str(value)
+
+
+def to_id_string(col):
+    # ids are kept as strings: an integer column with a null turns into float64,
+    # which cannot hold ids above 2**53 exactly
+    if pd.api.types.infer_dtype(col, skipna=True) in ("string", "empty"):
+        return col
+    if pd.api.types.is_integer_dtype(col):
+        return col.astype(str).astype(object)
+    return col.map(id_text).astype(object)
+
+
+def to_float32(col):
+    if pd.api.types.is_bool_dtype(col) or pd.api.types.is_integer_dtype(col):
+        return col
+    if not pd.api.types.is_numeric_dtype(col):
+        converted = pd.to_numeric(col, errors="coerce")
+        if converted.notna().sum() != col.notna().sum():
+            return col
+        col = converted
+    if col.dtype == "float32":
+        return col
+    narrowed = col.astype("float32")
+    if ((narrowed.astype("float64") - col).abs() > FLOAT32_TOLERANCE).any():
+        return col
+    return narrowed
+
+
+def string_ids(df):
+    # both sides of a merge need the same id type or the dedup keys never match
+    for col in ID_COLUMNS:
+        if col in df.columns:
+            df[col] = to_id_string(df[col])
+    return df
+
+
+def apply_schema(df):
+    if df is None or df.empty:
+        return df
+
+    df = df.copy()
+
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = to_category(df[col])
+
+    df = string_ids(df)
+
+    for col in FLOAT32_COLUMNS:
+        if col in df.columns:
+            df[col] = to_float32(df[col])
+
+    return df
+
+
+def legacy_memory_usage(df):
+    if df is None or df.empty:
+        return 0
+
+    legacy = {}
+    for col in df.columns:
+        dtype = df[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            legacy[col] = object
+        elif dtype == "float32":
+            legacy[col] = "float64"
+
+    return int(df.astype(legacy).memory_usage(deep=True).sum())
+
+
+ALERT_TABLE_KEYS = ["theft_raw", "fill_raw", "theft_cev", "fill_cev", "low_fuel_raw", "data_loss_raw"]
+
+def build_memory_report(results):
+    rows = []
+
+    for region, data in results.items():
+        for key in ALERT_TABLE_KEYS:
+            df = data.get(key)
+            if not isinstance(df, pd.DataFrame) or df.empty:
+                continue
+
+            legacy_bytes = legacy_memory_usage(df)
+            typed_bytes = int(df.memory_usage(deep=True).sum())
+            rows.append({
+                "Region": region,
+                "Dataset": key,
+                "Rows": len(df),
+                "Legacy MB": round(legacy_bytes / 2**20, 2),
+                "Typed MB": round(typed_bytes / 2**20, 2),
+                "Saved (%)": round((1 - typed_bytes / legacy_bytes) * 100, 1) if legacy_bytes else 0.0
+            })
+
+    return pd.DataFrame(rows, columns=["Region", "Dataset", "Rows", "Legacy MB", "Typed MB", "Saved (%)"])
+
+
+def rule_mask(df, col, rule_set):
+    if col not in df.columns:
+        return np.zeros(len(df), dtype=bool)
+
+    values = df[col]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+    else:
+        codes, uniques = pd.factorize(values)
+
+    lookup = np.fromiter((u in rule_set for u in uniques), dtype=bool, count=len(uniques))
+    # code -1 marks missing values and lands on the trailing False
+    return np.append(lookup, False)[codes]
+
+
+def classify_alerts(df):
+    if df is None or not any(c in df.columns for c in RULE_COLUMNS):
+        return df
+
+    df = df.copy()
+
+    is_mce = rule_mask(df, "vehicle_type", MCE_TYPE_SET)
+    is_excluded_model = rule_mask(df, "model", EXCLUDED_MODEL_SET)
+    is_closed = rule_mask(df, "account_stage", CLOSED_STAGE_SET)
+
+    df["is_closed_account"] = is_closed
+    df["is_cev"] = is_mce & ~is_closed
+    df["is_dpl"] = ~(is_mce | is_excluded_model | is_closed)
+
+    return df
+
+
 def clean_common_filters(df):
     df = df.copy()
 
     if "time" in df.columns:
         df["time"] = pd.to_datetime(df["time"], errors="coerce").dt.tz_localize(None)
 
-    if "vehicle_type" in df.columns:
-        df = df[~df["vehicle_type"].isin(MCE_TYPES)]
+    if "is_dpl" not in df.columns:
+        df = classify_alerts(df)
 
-    if "model" in df.columns:
-        df = df[~df["model"].isin(EXCLUDED_MODELS)]
-
-    if "account_stage" in df.columns:
-        df = df[~df["account_stage"].isin(["closed"])]
+    if "is_dpl" in df.columns:
+        df = df[df["is_dpl"]]
 
     return df
 
@@ -155,12 +421,11 @@ def build_cev_df(df):
     if "time" in df.columns:
         df["time"] = pd.to_datetime(df["time"], errors="coerce").dt.tz_localize(None)
 
+    if "is_cev" not in df.columns:
+        df = classify_alerts(df)
 
-    if "vehicle_type" in df.columns:
-        df = df[df["vehicle_type"].isin(MCE_TYPES)]
-
-    if "account_stage" in df.columns:
-        df = df[~df["account_stage"].isin(["closed"])]
+    if "is_cev" in df.columns:
+        df = df[df["is_cev"]]
 
     return df
 
@@ -191,34 +456,28 @@ def data_loss_query(start, end):
     })
 
 
-def get_data_loss_alerts(start, end, url):
-    return DashboardQueryLoader(url, data_loss_query(start, end)).fetch()
-def fetch_data_loss_batches(start_ms, end_ms, url):
-    ranges = []
-    cur = start_ms
+def get_data_loss_alerts(start, end, url, cache=None):
+    return fetch_query(url, data_loss_query(start, end), cache)
+def flatten_loss_meta(df):
+    if df is None or df.empty:
+        return df
+
+    df = df.copy()
 
-    while cur < end_ms:
-        nxt = min(cur + BATCH_SIZE_MS, end_ms)
-        ranges.append((cur, nxt))
-        cur = nxt
+    meta = [x if isinstance(x, dict) else {} for x in df["loss_meta"]] if "loss_meta" in df.columns else [{}] * len(df)
+    flat = pd.json_normalize(meta, sep="_")
+    flat.index = df.index
 
-    rows = []
+    loss_type = flat["type"] if "type" in flat.columns else pd.Series(None, index=df.index, dtype=object)
+    labels = loss_type.astype("string").str.replace("_", " ").str.capitalize()
+    df["data_loss_type"] = labels.mask(labels.isna() | (labels == ""), "Unknown").astype(object)
 
-    def fetch_one(s, e):
-        try:
-            res = get_data_loss_alerts(s, e, url)
-            return res.get("result", {}).get("output", [])
-        except Exception as err:
-            print(f" Data loss fetch error {s} → {e}: {err}")
-            error_msg = f" Data loss fetch error {s} → {e}: {err}"
-            API_ERRORS.append(error_msg)
-            return []
+    for col in flat.columns.drop("type", errors="ignore"):
+        values = pd.to_numeric(flat[col], errors="coerce")
+        df[f"loss_{col}"] = values if values.notna().sum() == flat[col].notna().sum() else flat[col]
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
-        for fut in as_completed([ex.submit(fetch_one, s, e) for s, e in ranges]):
-            rows.extend(fut.result())
+    return df
 
-    return pd.DataFrame(rows)
 
 def prepare_data_loss_table(df, region):
     if df is None or df.empty:
@@ -232,14 +491,10 @@ def prepare_data_loss_table(df, region):
             ]
         )
 
-    df = df.copy()
-
-    df["data_loss_type"] = df["loss_meta"].apply(
-        lambda x: x.get("type").replace("_", " ").capitalize()
-        if isinstance(x, dict) and x.get("type")
-        else "Unknown"
-    )
+    if "data_loss_type" not in df.columns:
+        df = flatten_loss_meta(df)
 
+    df = df.copy()
     df["region"] = region
 
     return df[[
@@ -251,23 +506,19 @@ def prepare_data_loss_table(df, region):
     ]]
 
 def build_data_loss_summary(df):
-    if df is None or df.empty or "loss_meta" not in df.columns:
+    if df is None or df.empty or ("loss_meta" not in df.columns and "data_loss_type" not in df.columns):
         return pd.DataFrame(columns=["Data loss type", "Count"])
 
-    df = df.copy()
-    df["Data loss type"] = df["loss_meta"].apply(
-        lambda x: x.get("type").replace("_", " ").capitalize()
-        if isinstance(x, dict) and x.get("type") else "Unknown"
-    )
+    if "data_loss_type" not in df.columns:
+        df = flatten_loss_meta(df)
 
-    summary = (
-        df["Data loss type"]
-        .value_counts()
-        .reset_index()
-        .rename(columns={"index": "Data loss type", "Data loss type": "Count"})
-    )
+    counts = df["data_loss_type"].value_counts()
+    counts = counts[counts > 0]
 
-    return summary
+    return pd.DataFrame({
+        "Data loss type": counts.index.astype(str),
+        "Count": counts.to_numpy()
+    })
 
 def low_fuel_query(start, end):
     return json.dumps({
@@ -293,35 +544,8 @@ def low_fuel_query(start, end):
             "alert_fuel_low_level.type": {"value": True, "as": "type"}
         }
     })
-def get_low_fuel_alerts(start, end, url):
-    return DashboardQueryLoader(url, low_fuel_query(start, end)).fetch()
-def fetch_low_fuel_batches(start_ms, end_ms, url):
-    ranges = []
-    cur = start_ms
-
-    while cur < end_ms:
-        nxt = min(cur + BATCH_SIZE_MS, end_ms)
-        ranges.append((cur, nxt))
-        cur = nxt
-
-    all_rows = []
-
-    def fetch_one(s, e):
-        try:
-            res = get_low_fuel_alerts(s, e, url)
-            return res.get("result", {}).get("output", [])
-        except Exception as err:
-            print(f" Low fuel fetch error {s} → {e}: {err}")
-            error_msg= f" Low fuel fetch error {s} → {e}: {err}"
-            API_ERRORS.append(error_msg)
-            return []
-
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
-        futures = [ex.submit(fetch_one, s, e) for s, e in ranges]
-        for fut in as_completed(futures):
-            all_rows.extend(fut.result())
-
-    return pd.DataFrame(all_rows)
+def get_low_fuel_alerts(start, end, url, cache=None):
+    return fetch_query(url, low_fuel_query(start, end), cache)
 def build_daily_alert_count_df(df):
     if df is None or df.empty or "time" not in df.columns:
         return pd.DataFrame(columns=["time", "vehicle_id", "moving average"])
@@ -519,8 +743,53 @@ def save_checkpoint(path: Path, ts: int):
 
 
 
-def theft_query(start, end):
-    return json.dumps({
+DIMENSION_TABLES = ("vehicle", "account", "spec")
+DIMENSION_KEY_FIELDS = ("vehicle.id", "account.id")
+
+
+def slim_select(select):
+    return {
+        field: spec for field, spec in select.items()
+        if field in DIMENSION_KEY_FIELDS or field.split(".")[0] not in DIMENSION_TABLES
+    }
+
+
+def dimension_aliases(select):
+    return {
+        field: spec["as"] for field, spec in select.items()
+        if field not in DIMENSION_KEY_FIELDS and field.split(".")[0] in DIMENSION_TABLES
+    }
+
+
+def theft_query(start, end, slim=False):
+    select = {
+        "vehicle.id": {"value": True, "as": "vehicle_id"},
+        "account.id": {"value": True, "as": "account_id"},
+        "vehicle.tag": {"value": True, "as": "tag"},
+        "vehicle.vin": {"value": True, "as": "vin"},
+        "account.display_name": {"value": True, "as": "account_name"},
+        "alert_fuel_theft.ignore": {"value": True, "as": "alert_fuel_theft_ignore"},
+        "alert_fuel_theft.ignore_reasons": {"value": True, "as": "ignore_reasons"},
+        "alert_fuel_theft.timestamp": {"value": True, "as": "time"},
+        "alert_fuel_theft.amount": {"value": True, "as": "amount"},
+        "alert_fuel_theft.amount_in_kgs": {"value": True, "as": "amount_in_kgs"},
+        "alert_fuel_theft.probable_variation": {"value": True, "as": "probable_variation"},
+        "spec.manufacturer": {"value": True, "as": "spec_manufacturer"},
+        "spec.model": {"value": True, "as": "model"},
+        "spec.fuel_capacity": {"value": True, "as": "fuel_capacity"},
+        "spec.id": {"value": True, "as": "spec_id"},
+        "spec.vehicle_type": {"value": True, "as": "vehicle_type"},
+        "spec.fuel_type": {"value": True, "as": "fuel_type"},
+        "spec.emmission_standard": {"value": True, "as": "emission_standard"},
+        "spec.max_load_capacity": {"value": True, "as": "max_load_capacity"},
+        "account.stage":{"value":True,"as":"account_stage"},
+        "vehicle.tags":{"value":True,"as":"vehicle tags"},
+        "spec.tags":{"value":True,"as":"spec tags"}
+    }
+    if slim:
+        select = slim_select(select)
+
+    query = {
         "report": "default",
         "filter": [
             {
@@ -530,36 +799,39 @@ def theft_query(start, end):
                 }
             }
         ],
-        "select": {
-            "vehicle.id": {"value": True, "as": "vehicle_id"},
-            "account.id": {"value": True, "as": "account_id"},
-            "vehicle.tag": {"value": True, "as": "tag"},
-            "vehicle.vin": {"value": True, "as": "vin"},
-            "account.display_name": {"value": True, "as": "account_name"},
-            "alert_fuel_theft.ignore": {"value": True, "as": "alert_fuel_theft_ignore"},
-            "alert_fuel_theft.ignore_reasons": {"value": True, "as": "ignore_reasons"},
-            "alert_fuel_theft.timestamp": {"value": True, "as": "time"},
-            "alert_fuel_theft.amount": {"value": True, "as": "amount"},
-            "alert_fuel_theft.amount_in_kgs": {"value": True, "as": "amount_in_kgs"},
-            "alert_fuel_theft.probable_variation": {"value": True, "as": "probable_variation"},
-            "spec.manufacturer": {"value": True, "as": "spec_manufacturer"},
-            "spec.model": {"value": True, "as": "model"},
-            "spec.fuel_capacity": {"value": True, "as": "fuel_capacity"},
-            "spec.id": {"value": True, "as": "spec_id"},
-            "spec.vehicle_type": {"value": True, "as": "vehicle_type"},
-            "spec.fuel_type": {"value": True, "as": "fuel_type"},
-            "spec.emmission_standard": {"value": True, "as": "emission_standard"},
-            "spec.max_load_capacity": {"value": True, "as": "max_load_capacity"},
-            "account.stage":{"value":True,"as":"account_stage"},
-            "vehicle.tags":{"value":True,"as":"vehicle tags"},
-            "spec.tags":{"value":True,"as":"spec tags"}
-        
-        }
-    })
-
+        "select": select
+    }
+    return json.dumps(query)
+
+
+def filling_query(start, end, slim=False):
+    select = {
+        "vehicle.id": {"value": True, "as": "vehicle_id"},
+        "account.id": {"value": True, "as": "account_id"},
+        "vehicle.tag": {"value": True, "as": "tag"},
+        "vehicle.vin": {"value": True, "as": "vin"},
+        "account.display_name": {"value": True, "as": "account_name"},
+        "alert_fuel_filling.timestamp": {"value": True, "as": "time"},
+        "alert_fuel_filling.id": {"value": True, "as": "id"},
+        "alert_fuel_filling.amount": {"value": True, "as": "amount"},
+        "alert_fuel_filling.amount_in_kgs": {"value": True, "as": "Amount_kgs"},
+        "alert_fuel_filling.ignore": {"value": True, "as": "alert_fuel_filling_ignore"},
+        "alert_fuel_filling.probable_variation": {"value": True, "as": "probable_variation"},
+        "alert_fuel_filling.ignore_reasons": {"value": True, "as": "ignore_reasons"},
+        "spec.manufacturer": {"value": True, "as": "manufacturer"},
+        "spec.vehicle_type": {"value": True, "as": "vehicle_type"},
+        "spec.fuel_type": {"value": True, "as": "fuel_type"},
+        "spec.model": {"value": True, "as": "model"},
+        "spec.fuel_capacity": {"value": True, "as": "fuel_capacity"},
+        "spec.emmission_standard": {"value": True, "as": "emission_standard"},
+        "account.stage":{"value":True,"as":"account_stage"},
+        "vehicle.tags":{"value":True,"as":"vehicle tags"},
+        "spec.tags":{"value":True,"as":"spec tags"}
+    }
+    if slim:
+        select = slim_select(select)
 
-def filling_query(start, end):
-    return json.dumps({
+    query = {
         "report": "default",
         "filter": [
             {
@@ -569,76 +841,111 @@ def filling_query(start, end):
                 }
             }
         ],
-        "select": {
-            "vehicle.id": {"value": True, "as": "vehicle_id"},
-            "account.id": {"value": True, "as": "account_id"},
-            "vehicle.tag": {"value": True, "as": "tag"},
-            "vehicle.vin": {"value": True, "as": "vin"},
-            "account.display_name": {"value": True, "as": "account_name"},
-            "alert_fuel_filling.timestamp": {"value": True, "as": "time"},
-            "alert_fuel_filling.id": {"value": True, "as": "id"},
-            "alert_fuel_filling.amount": {"value": True, "as": "amount"},
-            "alert_fuel_filling.amount_in_kgs": {"value": True, "as": "Amount_kgs"},
-            "alert_fuel_filling.ignore": {"value": True, "as": "alert_fuel_filling_ignore"},
-            "alert_fuel_filling.probable_variation": {"value": True, "as": "probable_variation"},
-            "alert_fuel_filling.ignore_reasons": {"value": True, "as": "ignore_reasons"},
-            "spec.manufacturer": {"value": True, "as": "manufacturer"},
-            "spec.vehicle_type": {"value": True, "as": "vehicle_type"},
-            "spec.fuel_type": {"value": True, "as": "fuel_type"},
-            "spec.model": {"value": True, "as": "model"},
-            "spec.fuel_capacity": {"value": True, "as": "fuel_capacity"},
-            "spec.emmission_standard": {"value": True, "as": "emission_standard"},
-            "account.stage":{"value":True,"as":"account_stage"},
-            "vehicle.tags":{"value":True,"as":"vehicle tags"},
-            "spec.tags":{"value":True,"as":"spec tags"}
-        }
-    })
+        "select": select
+    }
+    return json.dumps(query)
 
 
 
-def get_theft_alerts(start, end, url):
-    return DashboardQueryLoader(url, theft_query(start, end)).fetch()
+def get_theft_alerts(start, end, url, slim=False, cache=None):
+    return fetch_query(url, theft_query(start, end, slim), cache)
 
 
-def get_filling_alerts(start, end, url):
-    return DashboardQueryLoader(url, filling_query(start, end)).fetch()
+def get_filling_alerts(start, end, url, slim=False, cache=None):
+    return fetch_query(url, filling_query(start, end, slim), cache)
 
 
+# dimension field -> column name each alert dataset carries it under
+DIMENSION_ALIASES = {
+    "theft": dimension_aliases(json.loads(theft_query(0, 0))["select"]),
+    "fill": dimension_aliases(json.loads(filling_query(0, 0))["select"]),
+}
+DIMENSION_FIELDS = list(dict.fromkeys(f for aliases in DIMENSION_ALIASES.values() for f in aliases))
 
-def fetch_batches(start_ms, end_ms, url):
-    ranges = []
-    cur = start_ms
 
-    while cur < end_ms:
-        nxt = min(cur + BATCH_SIZE_MS, end_ms)
-        ranges.append((cur, nxt))
-        cur = nxt
+def dimension_query(vehicle_ids):
+    select = {"vehicle.id": {"value": True, "as": "vehicle.id"}}
+    select.update({field: {"value": True, "as": field} for field in DIMENSION_FIELDS})
+
+    return json.dumps({
+        "report": "default",
+        "filter": [
+            {
+                "vehicle.id": {
+                    "in": list(vehicle_ids)
+                }
+            }
+        ],
+        "select": select
+    })
+
+
+def get_dimensions(vehicle_ids, url):
+    return DashboardQueryLoader(url, dimension_query(vehicle_ids)).fetch()
 
-    theft_all, fill_all = [], []
 
-    def fetch_pair(s, e):
+def dimension_key(col):
+    return col.astype(str)
+
+
+def refresh_dimensions(dims, vehicle_ids, url, path):
+    now_ms = int(pd.Timestamp.now().timestamp() * 1000)
+
+    known = set(dimension_key(dims["vehicle.id"])) if not dims.empty else set()
+    stale = set()
+    if not dims.empty:
+        stale = set(dimension_key(dims.loc[dims["refreshed_ms"] < now_ms - DIMENSION_REFRESH_MS, "vehicle.id"]))
+    wanted = sorted((set(map(str, vehicle_ids)) - known) | stale)
+    if not wanted:
+        return dims, True
+
+    def fetch_one(batch):
         try:
-            t = get_theft_alerts(s, e, url)
-            f = get_filling_alerts(s, e, url)
-            return (
-                t.get("result", {}).get("output", []),
-                f.get("result", {}).get("output", [])
-            )
+            return get_dimensions(batch, url).get("result", {}).get("output", [])
         except Exception as err:
-            print(f" Error fetching {s} → {e}: {err}")
-            error_msg = f" Error fetching {s} → {e}: {err}"
+            print(f" Error fetching dimensions for {len(batch)} vehicles: {err}")
+            error_msg = f" Error fetching dimensions for {len(batch)} vehicles: {err}"
             API_ERRORS.append(error_msg)
-            return [], []
+            return None
+
+    rows = []
+    ok = True
+    batches = [wanted[i:i + DIMENSION_BATCH_SIZE] for i in range(0, len(wanted), DIMENSION_BATCH_SIZE)]
 
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
-        futures = [ex.submit(fetch_pair, s, e) for s, e in ranges]
+        for fut in as_completed([ex.submit(fetch_one, batch) for batch in batches]):
+            output = fut.result()
+            if output is None:
+                ok = False
+                continue
+            rows.extend(output)
 
-        for fut in as_completed(futures):
-            t, fl = fut.result()
-            theft_all.extend(t)
-            fill_all.extend(fl)
+    if not rows:
+        return dims, ok
+
+    # ids are stored as strings so they read back exactly
+    fresh = pd.DataFrame(rows, columns=["vehicle.id", *DIMENSION_FIELDS])
+    fresh["vehicle.id"] = dimension_key(fresh["vehicle.id"])
+    fresh["refreshed_ms"] = now_ms
+    dims = pd.concat([dims, fresh], ignore_index=True) if not dims.empty else fresh
+    dims = dims.drop_duplicates(subset="vehicle.id", keep="last", ignore_index=True)
+
+    write_jsonl(dims, path)
+    return dims, ok
+
+
+def attach_dimensions(df, dataset, dims):
+    if df.empty or "vehicle_id" not in df.columns:
+        return df
+
+    aliases = DIMENSION_ALIASES[dataset]
+    # no known vehicles yet (or a field the API did not return) leaves the columns empty
+    view = dims.reindex(columns=["vehicle.id", *aliases]).rename(columns=aliases)
+    view["_vehicle_key"] = dimension_key(view.pop("vehicle.id"))
 
-    return pd.DataFrame(theft_all), pd.DataFrame(fill_all)
+    df = df.drop(columns=[c for c in aliases.values() if c in df.columns])
+    df["_vehicle_key"] = dimension_key(df["vehicle_id"])
+    return df.merge(view, on="_vehicle_key", how="left").drop(columns="_vehicle_key")
 
 
 def ensure_timestamp_consistency(df):
@@ -656,11 +963,16 @@ def ensure_timestamp_consistency(df):
     
     return df
 
-def read_jsonl(path: Path) -> pd.DataFrame:
+# ids are written as strings; left to inference they come back as floats
+# and ids above 2**53 lose their last digits
+ID_DTYPES = {**{col: object for col in ID_COLUMNS}, "entity_id": object}
+
+
+def read_jsonl(path: Path, dtype=True) -> pd.DataFrame:
     if not path.exists():
         return pd.DataFrame()
     try:
-        df = pd.read_json(path, lines=True)
+        df = pd.read_json(path, lines=True, dtype=dtype)
         if not df.empty and "time" in df.columns:
             return ensure_timestamp_consistency(df)
         return df
@@ -675,21 +987,108 @@ def write_jsonl(df: pd.DataFrame, path: Path):
 
     df.to_json(path, orient="records", lines=True, date_format="iso")
 
+def read_table(path: Path, columns=None) -> pd.DataFrame:
+    if not path.exists():
+        return pd.DataFrame()
+    if columns is not None:
+        names = pq.read_schema(path).names
+        columns = [c for c in columns if c in names]
+    table = pq.read_table(path, columns=columns)
+    df = table.to_pandas()
+    # nested columns come back as numpy arrays; the pipeline expects python lists and dicts
+    for field in table.schema:
+        if pa.types.is_list(field.type) or pa.types.is_struct(field.type):
+            df[field.name] = pd.Series(table.column(field.name).to_pylist(), index=df.index, dtype=object)
+    return df
+
+
+def arrow_accepts(col):
+    try:
+        pa.array(col, from_pandas=True)
+    except (pa.ArrowException, ValueError):
+        return False
+    return True
+
+
+def uniform_column(col):
+    values = col.dropna()
+    if values.map(lambda x: isinstance(x, (list, tuple, np.ndarray))).any():
+        # the API sends a lone value where it usually sends a list, e.g. usfs or ignore_reasons
+        return col.map(lambda x: list(x) if isinstance(x, (list, tuple, np.ndarray)) else (None if pd.isna(x) else [x]))
+    if values.map(lambda x: isinstance(x, dict)).any():
+        return col
+    # plain values of more than one type, e.g. numbers and strings
+    return col.map(lambda x: None if pd.isna(x) else str(x))
+
+
+def write_table(df: pd.DataFrame, path: Path, compression=HOT_COMPRESSION):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        df.to_parquet(path, index=False, **compression)
+    except (pa.ArrowException, ValueError):
+        # only the columns arrow rejects are brought to one shape; a column that
+        # still does not fit raises rather than being stored in another form
+        mixed = {
+            col: uniform_column(df[col])
+            for col in df.columns if df[col].dtype == object and not arrow_accepts(df[col])
+        }
+        df.assign(**mixed).to_parquet(path, index=False, **compression)
+
+
+def append_jsonl(df: pd.DataFrame, path: Path):
+    if df is None or df.empty:
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        df.to_json(f, orient="records", lines=True, date_format="iso")
+        f.write("\n")
+
 def load_checkpoint(path: Path):
     if not path.exists():
         return None
     try:
         with open(path, "r") as f:
-            return json.load(f).get("last_fetched_ms")
+            checkpoint = json.load(f)
     except:
         return None
+    if checkpoint.get("store_version") != STORE_VERSION:
+        return None
+    return checkpoint.get("last_fetched_ms")
 
 def save_checkpoint(path: Path, ts: int):
     path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "w") as f:
-        json.dump({"last_fetched_ms": ts}, f)
+    # written next to the region's checkpoint and swapped in, so a crash never leaves it half written
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"last_fetched_ms": ts, "store_version": STORE_VERSION}, f)
+    tmp_path.replace(path)
 
-def merge_and_deduplicate(old_df, new_df, subset_cols=None):
+def reset_stale_store(region):
+    region_dir = CACHE_DIR / region
+    checkpoint_path = region_dir / "checkpoint.json"
+    version = None
+    if checkpoint_path.exists():
+        try:
+            with open(checkpoint_path, "r") as f:
+                version = json.load(f).get("store_version")
+        except (OSError, ValueError, AttributeError) as err:
+            raise RuntimeError(f"{region}: unreadable checkpoint {checkpoint_path}: {err}") from err
+        if version == STORE_VERSION:
+            return
+
+    # the hot tier and everything derived from it are rebuilt (mostly from the
+    # response cache); history segments keep raw rows and stay as they are
+    stale = [path for path in region_dir.iterdir() if path.name not in KEPT_ON_RESET] if region_dir.exists() else []
+    if stale:
+        print(f"{region}: store version {version} != {STORE_VERSION}, rebuilding hot tier and aggregates")
+    for path in stale:
+        if path.is_dir():
+            shutil.rmtree(path)
+        else:
+            path.unlink()
+    save_checkpoint(checkpoint_path, None)
+
+def merge_and_deduplicate_full(old_df, new_df, subset_cols=None):
 
     combined = pd.concat([old_df, new_df], ignore_index=True)
     
@@ -711,207 +1110,297 @@ def merge_and_deduplicate(old_df, new_df, subset_cols=None):
         combined = combined.sort_values(by="time_ms")
         
     return combined
-def run_region(region, url, start_ms, end_ms):
-    theft_df, fill_df = fetch_batches(start_ms, end_ms, url)
 
-    if "probable_variation" in theft_df.columns:
-        theft_df["probable_variation_max"] = theft_df["probable_variation"].apply(safe_parse_variation)
-    else:
-        theft_df["probable_variation_max"] = None
 
-    if "probable_variation" in fill_df.columns:
-        fill_df["probable_variation_max"] = fill_df["probable_variation"].apply(safe_parse_variation)
-    else:
-        fill_df["probable_variation_max"] = None
+def key_index(df, keys):
+    if len(keys) == 1:
+        return pd.Index(df[keys[0]])
+    return pd.MultiIndex.from_frame(df[keys])
 
-    if region == "NASA":
-        if "amount" in theft_df.columns:
-            theft_df["amount"] *= GALLON_CONVERSION
-        if "amount" in fill_df.columns:
-            fill_df["amount"] *= GALLON_CONVERSION
 
-    if region == "FML":
-        if "amount_in_kgs" in theft_df.columns:
-            theft_df["amount"] = theft_df["amount_in_kgs"]
-        
-        if "amount_in_kgs" in fill_df.columns:
-            fill_df["amount"] = fill_df["amount_in_kgs"] 
+def merge_and_deduplicate(old_df, new_df, subset_cols=None):
+    if new_df is None or new_df.empty:
+        new_df = pd.DataFrame()
+
+    keys = [c for c in (subset_cols or []) if c in old_df.columns and c in new_df.columns]
+
+    # the stored table is already deduplicated and sorted by time_ms; anything
+    # else (legacy files, no keys) goes through the full concat/dedup/sort path
+    if (
+        old_df.empty or new_df.empty or not keys
+        or "time_ms" not in old_df.columns or "time_ms" not in new_df.columns
+        or not old_df["time_ms"].is_monotonic_increasing
+    ):
+        return merge_and_deduplicate_full(old_df, new_df, subset_cols)
+
+    new_df = new_df.drop_duplicates(subset=keys, keep="last")
+    new_df = new_df.sort_values(by="time_ms", kind="stable")
+    new_ms = new_df["time_ms"].to_numpy()
+
+    # delta rows win over stored rows with the same key; when time_ms is part
+    # of the key only the tail of the stored table can collide
+    start = int(old_df["time_ms"].searchsorted(new_ms[0], side="left")) if "time_ms" in keys else 0
+    superseded = np.zeros(len(old_df), dtype=bool)
+    superseded[start:] = key_index(old_df.iloc[start:], keys).isin(key_index(new_df, keys))
+    old_kept = old_df[~superseded] if superseded.any() else old_df
+
+    combined = pd.concat([old_kept, new_df], ignore_index=True)
+    old_ms = old_kept["time_ms"].to_numpy()
+
+    if not len(old_ms) or new_ms[0] >= old_ms[-1]:
+        return combined
 
-    theft_df = ensure_time_columns(theft_df)
-    fill_df = ensure_time_columns(fill_df)
+    # splice the sorted delta into the sorted stored rows in a single pass
+    new_pos = np.searchsorted(old_ms, new_ms, side="right") + np.arange(len(new_ms))
+    is_new = np.zeros(len(combined), dtype=bool)
+    is_new[new_pos] = True
 
+    order = np.empty(len(combined), dtype=np.int64)
+    order[~is_new] = np.arange(len(old_ms))
+    order[is_new] = len(old_ms) + np.arange(len(new_ms))
 
-    theft_cev = build_cev_df(theft_df)
-    fill_cev = build_cev_df(fill_df)
+    return combined.iloc[order]
 
-    theft_df = clean_common_filters(theft_df)
-    fill_df = clean_common_filters(fill_df)
-    
-    low_fuel_df = fetch_low_fuel_batches(start_ms, end_ms, url)
-    low_fuel_df = ensure_time_columns(low_fuel_df)
-    low_fuel_df = clean_common_filters(low_fuel_df)
 
-    theft_df_pv = theft_df[~theft_df["probable_variation_max"].isna()].copy()
-    fill_df_pv = fill_df[~fill_df["probable_variation_max"].isna()].copy()
+def normalize_alerts(df, dataset):
+    if df is None or df.empty:
+        return pd.DataFrame()
 
-    theft_df_usfs = add_usfs_column(theft_df)
-    fill_df_usfs = add_usfs_column(fill_df)
+    df = df.copy()
 
-    theft_df_usfs = theft_df_usfs[theft_df_usfs["usfs"].apply(contains_usfs)].copy()
-    fill_df_usfs = fill_df_usfs[fill_df_usfs["usfs"].apply(contains_usfs)].copy()
+    if dataset in ("theft", "fill"):
+        if "probable_variation" in df.columns:
+            df["probable_variation_max"] = df["probable_variation"].apply(safe_parse_variation)
+        else:
+            df["probable_variation_max"] = None
 
-    return {
-        "theft_raw": theft_df,
-        "fill_raw": fill_df,
-        "low_fuel_raw": low_fuel_df,
+    df = ensure_timestamp_consistency(df)
 
+    if dataset in ("theft", "fill") and not df.empty:
+        df = add_usfs_column(df)
 
-        "theft_cev": theft_cev,
-        "fill_cev": fill_cev,
+    if dataset == "data_loss":
+        df = flatten_loss_meta(df)
 
-        "theft_daily": build_daily_df(theft_df),
-        "fill_daily": build_daily_df(fill_df),
-        "low_fuel_daily": build_daily_alert_count_df(low_fuel_df),
+    return apply_schema(df)
 
 
-        "theft_cev_daily": build_daily_df(theft_cev),
-        "fill_cev_daily": build_daily_df(fill_cev),
+STREAM_DATASETS = {
+    "theft": get_theft_alerts,
+    "fill": get_filling_alerts,
+    "low_fuel": get_low_fuel_alerts,
+    "data_loss": get_data_loss_alerts,
+}
 
-        "theft_raw_pv": theft_df_pv,
-        "fill_raw_pv": fill_df_pv,
-        "theft_pv_daily": build_daily_pv_df(theft_df_pv),
-        "fill_pv_daily": build_daily_pv_df(fill_df_pv),
+DEDUP_KEYS = {
+    "theft": ["vehicle_id", "time_ms"],
+    "fill": ["id"],
+    "low_fuel": ["id"],
+    "data_loss": ["vehicle_id", "time_ms"],
+}
 
-        "theft_raw_usfs": theft_df_usfs,
-        "fill_raw_usfs": fill_df_usfs,
-        "theft_usfs_daily": build_daily_amount_df(theft_df_usfs),
-        "fill_usfs_daily": build_daily_amount_df(fill_df_usfs),
-    }
-def run_region_cached(region, url):
-    region_dir = CACHE_DIR / region
-    theft_path = region_dir / "theft.jsonl"
-    fill_path = region_dir / "fill.jsonl"
-    low_fuel_path = region_dir / "low_fuel.jsonl"
-    data_loss_path = region_dir / "data_loss.jsonl"
-    
 
-    theft_cev_path = region_dir / "theft_cev.jsonl"
-    fill_cev_path = region_dir / "fill_cev.jsonl"
-    
-    checkpoint_path = region_dir / "checkpoint.json"
+def build_windows(start_ms, end_ms):
+    windows = []
+    # windows sit on fixed epoch boundaries so a refetch asks the exact queries a
+    # cached response was stored under
+    cur = start_ms - start_ms % BATCH_SIZE_MS
 
+    while cur < end_ms:
+        nxt = min(cur + BATCH_SIZE_MS, end_ms)
+        windows.append((cur, nxt))
+        cur = nxt
 
+    return windows
 
-    now = pd.Timestamp.now() - pd.Timedelta(days=2)
-    now_ms = int((now.normalize() + pd.Timedelta(days=1)).timestamp() * 1000)
-    
-    window_start = now.normalize() - pd.Timedelta(days=WINDOW_DAYS)
-    window_start_ms = int(window_start.timestamp() * 1000)
 
-    last_fetched_ms = load_checkpoint(checkpoint_path)
+def fetch_window(s, e, url, slim=False, cache=None, datasets=None):
+    rows = {}
+    ok = True
 
-    if last_fetched_ms and last_fetched_ms > window_start_ms:
-        fetch_start_ms = last_fetched_ms + 1
-    else:
-        fetch_start_ms = window_start_ms
+    for dataset, get_alerts in STREAM_DATASETS.items():
+        if datasets is not None and dataset not in datasets:
+            continue
+        try:
+            if dataset in DIMENSION_ALIASES:
+                res = get_alerts(s, e, url, slim=slim, cache=cache)
+            else:
+                res = get_alerts(s, e, url, cache=cache)
+            rows[dataset] = res.get("result", {}).get("output", [])
+        except Exception as err:
+            print(f" Error fetching {dataset} {s} → {e}: {err}")
+            error_msg = f" Error fetching {dataset} {s} → {e}: {err}"
+            API_ERRORS.append(error_msg)
+            ok = False
 
+    return rows, ok
 
-    new_data = {
-        "theft": pd.DataFrame(),
-        "fill": pd.DataFrame(),
-        "low_fuel": pd.DataFrame(),
-        "data_loss": pd.DataFrame(),
-        "theft_cev": pd.DataFrame(),  
-        "fill_cev": pd.DataFrame()    
-    }
 
-    if fetch_start_ms < now_ms:
-        print(f"Fetching {region} delta: {pd.to_datetime(fetch_start_ms, unit='ms')} -> Now")
-        
-        fresh = run_region(region, url, fetch_start_ms, now_ms)
-        new_data["theft"] = ensure_timestamp_consistency(fresh["theft_raw"])
-        new_data["fill"] = ensure_timestamp_consistency(fresh["fill_raw"])
-        new_data["low_fuel"] = ensure_timestamp_consistency(fresh["low_fuel_raw"])
-        
+def stream_region_to_store(region, url, start_ms, end_ms, region_dir):
+    windows = build_windows(start_ms, end_ms)
+    completed = [False] * len(windows)
+    contiguous = 0
 
-        new_data["theft_cev"] = ensure_timestamp_consistency(fresh["theft_cev"])
-        new_data["fill_cev"] = ensure_timestamp_consistency(fresh["fill_cev"])
+    slim = SLIM_QUERY_REGIONS.get(region, False)
+    cache = response_cache()
+    closed_before_ms = int(pd.Timestamp.now().timestamp() * 1000) - CLOSED_WINDOW_LAG_MS
+    dims_path = region_dir / "dimensions.jsonl"
+    dims = read_jsonl(dims_path, dtype={"vehicle.id": object}) if slim else None
 
-        dl_fresh = fetch_data_loss_batches(fetch_start_ms, now_ms, url)
-        dl_fresh = ensure_timestamp_consistency(dl_fresh)
-        new_data["data_loss"] = clean_common_filters(dl_fresh)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        futures = {
+            ex.submit(fetch_window, s, e, url, slim, cache if e <= closed_before_ms else None): i
+            for i, (s, e) in enumerate(windows)
+        }
 
+        for fut in as_completed(futures):
+            rows, ok = fut.result()
 
-    old_data = {
-        "theft": read_jsonl(theft_path),
-        "fill": read_jsonl(fill_path),
-        "low_fuel": read_jsonl(low_fuel_path),
-        "data_loss": read_jsonl(data_loss_path),
-        "theft_cev": read_jsonl(theft_cev_path),  
-        "fill_cev": read_jsonl(fill_cev_path)      
-    }
+            if slim and ok:
+                vehicle_ids = {r.get("vehicle_id") for d in DIMENSION_ALIASES for r in rows[d]}
+                vehicle_ids.discard(None)
+                dims, ok = refresh_dimensions(dims, vehicle_ids, url, dims_path)
 
+            for dataset, dataset_rows in rows.items():
+                if not dataset_rows:
+                    continue
+                df = pd.DataFrame(dataset_rows)
+                if slim and dataset in DIMENSION_ALIASES:
+                    # without the dimension join the rows cannot be classified, so
+                    # the window is left for the next refresh
+                    if not ok:
+                        continue
+                    df = attach_dimensions(df, dataset, dims)
+                append_jsonl(normalize_alerts(df, dataset), region_dir / f"{dataset}.delta.jsonl")
 
-    theft_all = merge_and_deduplicate(old_data["theft"], new_data["theft"], subset_cols=["vehicle_id", "time_ms"])
-    fill_all = merge_and_deduplicate(old_data["fill"], new_data["fill"], subset_cols=["id"])
+            completed[futures[fut]] = ok
 
-    low_fuel_all = merge_and_deduplicate(old_data["low_fuel"], new_data["low_fuel"], subset_cols=["id"])
-    data_loss_all = merge_and_deduplicate(old_data["data_loss"], new_data["data_loss"], subset_cols=["vehicle_id", "time_ms"])
-    
+            # the checkpoint only moves across an unbroken run of successful windows,
+            # so a failed window is fetched again on the next refresh
+            advanced = contiguous
+            while contiguous < len(windows) and completed[contiguous]:
+                contiguous += 1
+            if contiguous > advanced:
+                save_checkpoint(region_dir / "checkpoint.json", windows[contiguous - 1][1])
 
-    theft_cev_all = merge_and_deduplicate(old_data["theft_cev"], new_data["theft_cev"], subset_cols=["vehicle_id", "time_ms"])
-    fill_cev_all = merge_and_deduplicate(old_data["fill_cev"], new_data["fill_cev"], subset_cols=["id"])
+    cache.reduce_size(RESPONSE_CACHE_BYTES)
 
 
-    if not theft_all.empty: theft_all = theft_all[theft_all["time_ms"] >= window_start_ms]
-    if not fill_all.empty: fill_all = fill_all[fill_all["time_ms"] >= window_start_ms]
-    if not low_fuel_all.empty: low_fuel_all = low_fuel_all[low_fuel_all["time_ms"] >= window_start_ms]
-    if not data_loss_all.empty: data_loss_all = data_loss_all[data_loss_all["time_ms"] >= window_start_ms]
-    
+def history_dir(region, dataset):
+    return CACHE_DIR / region / "history" / dataset
 
-    if not theft_cev_all.empty: theft_cev_all = theft_cev_all[theft_cev_all["time_ms"] >= window_start_ms]
-    if not fill_cev_all.empty: fill_cev_all = fill_cev_all[fill_cev_all["time_ms"] >= window_start_ms]
 
+def month_keys(time_ms):
+    return pd.to_datetime(time_ms, unit="ms").dt.strftime("%Y-%m")
 
-    if not theft_all.empty: theft_all = add_usfs_column(theft_all)
-    if not fill_all.empty: fill_all = add_usfs_column(fill_all)
 
+def append_history(region, dataset, df):
+    if df is None or df.empty:
+        return
+    for month, part in df.groupby(month_keys(df["time_ms"])):
+        append_jsonl(part, history_dir(region, dataset) / f"{month}.delta.jsonl")
 
-    write_jsonl(theft_all, theft_path)
-    write_jsonl(fill_all, fill_path)
-    write_jsonl(low_fuel_all, low_fuel_path)
-    write_jsonl(data_loss_all, data_loss_path)
-    
 
-    write_jsonl(theft_cev_all, theft_cev_path)
-    write_jsonl(fill_cev_all, fill_cev_path)
-    
-    save_checkpoint(checkpoint_path, now_ms)
-    
+def compact_history(region, dataset):
+    # appended deltas are folded into one compressed parquet segment per month
+    for delta_path in sorted(history_dir(region, dataset).glob("*.jsonl")):
+        path = delta_path.with_name(f"{delta_path.name.split('.')[0]}.parquet")
+        merged = merge_and_deduplicate(
+            string_ids(read_table(path)), string_ids(read_jsonl(delta_path, dtype=ID_DTYPES)), subset_cols=DEDUP_KEYS[dataset]
+        )
+        write_table(apply_schema(merged), path, COLD_COMPRESSION)
+        delta_path.unlink()
 
-    theft_all_pv = theft_all[~theft_all["probable_variation_max"].isna()].copy() if "probable_variation_max" in theft_all.columns else pd.DataFrame()
-    fill_all_pv = fill_all[~fill_all["probable_variation_max"].isna()].copy() if "probable_variation_max" in fill_all.columns else pd.DataFrame()
 
-    return {
-        "theft_raw": theft_all,
-        "fill_raw": fill_all,
-        "low_fuel_raw": low_fuel_all,
-        "data_loss_raw": data_loss_all,
+def read_history(region, dataset, start_ms, end_ms, columns=None):
+    months = pd.period_range(
+        pd.to_datetime(start_ms, unit="ms"), pd.to_datetime(end_ms - 1, unit="ms"), freq="M"
+    ).strftime("%Y-%m")
 
+    frames = []
+    for month in months:
+        df = read_table(history_dir(region, dataset) / f"{month}.parquet", columns=columns)
+        if not df.empty:
+            frames.append(aggregates.slice_range(df, start_ms, end_ms, "time_ms"))
 
-        "theft_cev": theft_cev_all,
-        "fill_cev": fill_cev_all,
+    if not frames:
+        return pd.DataFrame()
+    return apply_schema(pd.concat(frames, ignore_index=True))
+
+
+def combine_tiers(cold_df, hot_df):
+    if cold_df is None or cold_df.empty:
+        return hot_df
+    if hot_df is None or hot_df.empty:
+        return cold_df
+    # categories differ between the tiers, so the schema is applied again on the union
+    return apply_schema(pd.concat([cold_df, hot_df], ignore_index=True))
+
+
+def project_columns(df, columns):
+    if columns is None or df is None or df.empty:
+        return df
+    return df[[c for c in columns if c in df.columns]]
 
-        "data_loss_table": prepare_data_loss_table(data_loss_all, region),
-        "data_loss_summary": build_data_loss_summary(data_loss_all),
 
-        "low_fuel_daily": build_daily_alert_count_df(low_fuel_all),
+def compact_dataset(region, dataset, window_start_ms, columns=None):
+    region_dir = CACHE_DIR / region
+    path = region_dir / f"{dataset}.parquet"
+    delta_path = region_dir / f"{dataset}.delta.jsonl"
+
+    # a settled store is read through the projection; anything that needs a
+    # rewrite falls through to the full-width merge below
+    if columns is not None and not delta_path.exists():
+        projected = read_table(path, columns=list(dict.fromkeys([*columns, "time", "time_ms"])))
+        settled = projected.empty or (projected["time_ms"] >= window_start_ms).all()
+        if dataset == "data_loss" and not projected.empty:
+            settled = settled and "data_loss_type" in projected.columns and projected["data_loss_type"].notna().all()
+        if settled:
+            return apply_schema(project_columns(projected, columns))
+
+    old_df = string_ids(read_table(path))
+    delta_df = string_ids(read_jsonl(delta_path, dtype=ID_DTYPES))
+
+    merged = merge_and_deduplicate(old_df, delta_df, subset_cols=DEDUP_KEYS[dataset])
+
+    # rows stored before loss_meta was flattened at ingest are flattened once here
+    needs_flatten = dataset == "data_loss" and not merged.empty and (
+        "data_loss_type" not in merged.columns or merged["data_loss_type"].isna().any()
+    )
+    if needs_flatten:
+        merged = flatten_loss_meta(merged)
+
+    if not merged.empty:
+        expired = merged["time_ms"] < window_start_ms
+        if expired.any():
+            append_history(region, dataset, merged[expired])
+            compact_history(region, dataset)
+        merged = merged[~expired]
+
+    merged = apply_schema(merged)
+
+    if not delta_df.empty or len(merged) != len(old_df) or needs_flatten:
+        write_table(merged, path)
+    delta_path.unlink(missing_ok=True)
+
+    return project_columns(merged, columns)
+
+
+def build_daily_frames(frames):
+    theft_all = frames["theft_raw"]
+    fill_all = frames["fill_raw"]
+
+    theft_all_pv = theft_all[~theft_all["probable_variation_max"].isna()].copy() if "probable_variation_max" in theft_all.columns else pd.DataFrame()
+    fill_all_pv = fill_all[~fill_all["probable_variation_max"].isna()].copy() if "probable_variation_max" in fill_all.columns else pd.DataFrame()
+
+    return {
+        "low_fuel_daily": build_daily_alert_count_df(frames["low_fuel_raw"]),
         "theft_daily": build_daily_df(theft_all),
         "fill_daily": build_daily_df(fill_all),
         
 
-        "theft_cev_daily": build_daily_df(theft_cev_all),
-        "fill_cev_daily": build_daily_df(fill_cev_all),
+        "theft_cev_daily": build_daily_df(frames["theft_cev"]),
+        "fill_cev_daily": build_daily_df(frames["fill_cev"]),
         
         "theft_usfs_daily": build_daily_amount_df(
             theft_all[theft_all["usfs"].apply(contains_usfs)] if "usfs" in theft_all.columns and not theft_all.empty else pd.DataFrame()
@@ -924,17 +1413,475 @@ def run_region_cached(region, url):
         "fill_pv_daily": build_daily_pv_df(fill_all_pv),
     }
 
-if __name__ == "__main__":
+
+def project_units(df, region):
+    projection = UNIT_PROJECTIONS.get(region)
+    if df is None or df.empty or not projection or "amount" not in df.columns:
+        return df
+
+    df = df.copy()
+    df["amount_liters"] = df["amount"]
+
+    if "source" in projection and projection["source"] in df.columns:
+        df["amount"] = df[projection["source"]]
+    if "scale" in projection:
+        df["amount"] = df["amount"] * projection["scale"]
+
+    return df
+
+
+def build_cross_region_totals(results):
+    rows = []
+
+    for region, data in results.items():
+        row = {"Region": region}
+        for label, key in [("Total Theft (L)", "theft_raw"), ("Total Refill (L)", "fill_raw")]:
+            df = data.get(key)
+            if not isinstance(df, pd.DataFrame) or df.empty or "amount" not in df.columns:
+                row[label] = 0.0
+                continue
+            column = "amount_liters" if "amount_liters" in df.columns else "amount"
+            row[label] = round(float(df[column].sum()), 2)
+        rows.append(row)
+
+    totals = pd.DataFrame(rows, columns=["Region", "Total Theft (L)", "Total Refill (L)"])
+    if not totals.empty:
+        totals.loc[len(totals)] = ["All regions", *totals.iloc[:, 1:].sum().round(2)]
+
+    return totals
+
+
+DISTINCT_LABELS = {
+    "Theft": ["theft", "theft_cev"],
+    "Refill": ["fill", "fill_cev"],
+    "Low fuel": ["low_fuel"],
+    "Data loss": ["data_loss"],
+}
+
+
+def build_cross_region_distinct(results):
+    # daily sketches merge across days and regions, so every row is one estimate
+    tables = {region: data.get("distinct") for region, data in results.items()}
+    rows = []
+
+    for label, group in [*[(region, [table]) for region, table in tables.items()], ("All regions", list(tables.values()))]:
+        row = {"Region": label}
+        for alert, metrics in DISTINCT_LABELS.items():
+            row[f"{alert} vehicles"] = aggregates.distinct_count(group, metrics, "vehicle")
+            row[f"{alert} accounts"] = aggregates.distinct_count(group, metrics, "account")
+        rows.append(row)
+
+    return pd.DataFrame(rows)
+
+
+def classify_region_frames(region, theft_all, fill_all, low_fuel_all, data_loss_all):
+    return {
+        "theft": classify_alerts(project_units(theft_all, region)),
+        "fill": classify_alerts(project_units(fill_all, region)),
+        "low_fuel": classify_alerts(low_fuel_all),
+        "data_loss": classify_alerts(data_loss_all),
+    }
+
+
+def split_classified_frames(classified):
+    return {
+        "theft_raw": clean_common_filters(classified["theft"]),
+        "fill_raw": clean_common_filters(classified["fill"]),
+        "low_fuel_raw": clean_common_filters(classified["low_fuel"]),
+        "data_loss_raw": clean_common_filters(classified["data_loss"]),
+        "theft_cev": build_cev_df(classified["theft"]),
+        "fill_cev": build_cev_df(classified["fill"]),
+    }
+
+
+def split_region_frames(region, theft_all, fill_all, low_fuel_all, data_loss_all):
+    return split_classified_frames(classify_region_frames(region, theft_all, fill_all, low_fuel_all, data_loss_all))
+
+
+def build_region_outputs(region, theft_all, fill_all, low_fuel_all, data_loss_all):
+    outputs = split_region_frames(region, theft_all, fill_all, low_fuel_all, data_loss_all)
+
+    outputs["data_loss_table"] = prepare_data_loss_table(outputs["data_loss_raw"], region)
+    outputs["data_loss_summary"] = build_data_loss_summary(outputs["data_loss_raw"])
+
+    return outputs
+
+
+def aggregate_dir(region):
+    return CACHE_DIR / region / "aggregates"
+
+
+def aggregate_fingerprint():
+    # anything that changes what a stored aggregate means forces a rebuild
+    rules = [
+        STORE_VERSION, aggregates.AGGREGATE_VERSION, sorted(MCE_TYPE_SET),
+        sorted(EXCLUDED_MODEL_SET), sorted(CLOSED_STAGE_SET), UNIT_PROJECTIONS, aggregates.LOSS_TOLERANCE_MS
+    ]
+    return hashlib.sha1(json.dumps(rules, sort_keys=True).encode()).hexdigest()
+
+
+def load_aggregate_meta(region):
+    path = aggregate_dir(region) / "meta.json"
+    if not path.exists():
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except:
+        return {}
+
+
+def save_aggregate_meta(region, meta):
+    path = aggregate_dir(region) / "meta.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(meta, f)
+
+
+def load_aggregate_tables(region):
+    return {path.stem: read_jsonl(path, dtype=ID_DTYPES) for path in sorted(aggregate_dir(region).glob("*.jsonl"))}
+
+
+def update_aggregates(region, classified, start_ms, end_ms, rebuild=False):
+    frames = split_classified_frames(classified)
+    tables = {} if rebuild else load_aggregate_tables(region)
+    out_dir = aggregate_dir(region)
+
+    for name, build in aggregates.AGGREGATE_BUILDERS.items():
+        tables[name] = aggregates.replace_range(tables.get(name), build(frames), start_ms, end_ms)
+        write_jsonl(tables[name], out_dir / f"{name}.jsonl")
+
+    for level in aggregates.ROLLUP_LEVELS:
+        write_jsonl(aggregates.coarsen(tables["rollup_hour"], level), out_dir / f"rollup_{level}.jsonl")
+
+    update_vehicle_index(region, classified, start_ms, end_ms, rebuild)
+    update_theft_scores(region, frames, start_ms, end_ms, rebuild)
+
+
+def attach_theft_scores(df, scores):
+    if df is None or df.empty or "vehicle_id" not in df.columns:
+        return df
+    keys = df[["vehicle_id", "time_ms"]].astype({"vehicle_id": str})
+    matched = keys.merge(
+        scores[["vehicle_id", "time_ms", "capacity_share", "robust_z"]].drop_duplicates(["vehicle_id", "time_ms"]),
+        on=["vehicle_id", "time_ms"], how="left"
+    )
+    return df.assign(capacity_share=matched["capacity_share"].to_numpy(), robust_z=matched["robust_z"].to_numpy())
+
+
+def theft_scores_path(region):
+    return CACHE_DIR / region / "theft_scores.jsonl"
+
+
+def load_theft_scores(region):
+    scores = read_jsonl(theft_scores_path(region), dtype=ID_DTYPES)
+    if scores.empty:
+        return pd.DataFrame(columns=aggregates.SCORE_COLUMNS)
+    return scores.astype({"vehicle_id": str, "account_id": str})
+
+
+def update_theft_scores(region, frames, start_ms, end_ms, rebuild=False):
+    stored = pd.DataFrame(columns=aggregates.SCORE_COLUMNS) if rebuild else load_theft_scores(region)
+    fresh = aggregates.theft_score_rows(frames)
+    fresh = aggregates.slice_range(fresh, start_ms, end_ms, "time_ms")
+
+    # only vehicles that gained or lost alerts in the range need their history rescored
+    replaced = aggregates.slice_range(stored, start_ms, end_ms, "time_ms")
+    touched = set(fresh["vehicle_id"]) | set(replaced["vehicle_id"])
+
+    scores = aggregates.replace_range(stored, fresh, start_ms, end_ms, key="time_ms")
+    if not scores.empty:
+        rescore = scores["vehicle_id"].isin(touched).to_numpy()
+        scores.loc[rescore, "robust_z"] = aggregates.robust_scores(scores[rescore])["robust_z"].to_numpy()
+
+    write_jsonl(scores, theft_scores_path(region))
+
+
+def vehicle_index_dir(region):
+    return CACHE_DIR / region / "vehicles"
+
+
+def update_vehicle_index(region, frames, start_ms, end_ms, rebuild=False):
+    index_dir = vehicle_index_dir(region)
+    if rebuild:
+        for path in index_dir.glob("*.jsonl"):
+            path.unlink()
+
+    events = aggregates.slice_range(aggregates.vehicle_events(frames), start_ms, end_ms, "time_ms")
+    partitions = aggregates.vehicle_partitions(events["vehicle_id"])
+
+    for partition in range(aggregates.VEHICLE_PARTITIONS):
+        path = index_dir / f"{partition:02d}.jsonl"
+        fresh = events[partitions == partition]
+        stored = read_jsonl(path, dtype=ID_DTYPES)
+        if fresh.empty and (stored.empty or not stored["time_ms"].between(start_ms, end_ms - 1).any()):
+            continue
+        write_jsonl(aggregates.replace_range(stored, fresh, start_ms, end_ms, key="time_ms"), path)
+
+
+def vehicle_timeline(region, vehicle_id, start_ms=None, end_ms=None):
+    vehicle_id = str(vehicle_id).strip()
+    partition = aggregates.vehicle_partitions(pd.Series([vehicle_id]))[0]
+    events = read_jsonl(vehicle_index_dir(region) / f"{partition:02d}.jsonl", dtype=ID_DTYPES)
+    if events.empty:
+        return pd.DataFrame(columns=["time", *aggregates.VEHICLE_EVENT_COLUMNS[1:]])
+
+    events = events[events["vehicle_id"] == vehicle_id]
+    if start_ms is not None or end_ms is not None:
+        events = aggregates.slice_range(events, start_ms or 0, end_ms or 2**62, "time_ms")
+
+    events = events.sort_values("time_ms", kind="stable").drop(columns="vehicle_id")
+    events.insert(0, "time", pd.to_datetime(events["time_ms"], unit="ms"))
+    return events.reset_index(drop=True)
+
+
+def history_start_ms(region):
+    months = [path.name.split(".")[0] for path in (CACHE_DIR / region / "history").glob("*/*.parquet")]
+    if not months:
+        return None
+    return int(pd.Timestamp(min(months) + "-01").timestamp() * 1000)
+
+
+def read_region_frames(region, hot, start_ms, window_start_ms, columns=None):
+    frames = {}
+    for dataset, hot_df in hot.items():
+        cold = pd.DataFrame()
+        if start_ms < window_start_ms:
+            cold = read_history(region, dataset, start_ms, window_start_ms, (columns or {}).get(dataset))
+        frames[dataset] = combine_tiers(cold, hot_df)
+    return frames
+
+
+def loss_context_start(dataset, start_ms):
+    # data-loss rows just before a range are kept so alerts at its start can join them
+    return start_ms - aggregates.LOSS_TOLERANCE_MS if dataset == "data_loss" else start_ms
+
+
+def refresh_aggregates(region, hot, window_start_ms):
+    meta = load_aggregate_meta(region)
+    fingerprint = aggregate_fingerprint()
+    covered_ms = load_checkpoint(CACHE_DIR / region / "checkpoint.json")
+
+    rebuild = meta.get("fingerprint") != fingerprint or not meta.get("covered_ms")
+    if not rebuild and meta["covered_ms"] == covered_ms:
+        return
+
+    if rebuild:
+        start_ms = min(history_start_ms(region) or window_start_ms, window_start_ms)
+    else:
+        # rows streamed since the last update all land after the old checkpoint's window;
+        # alerts just before it can still gain a data-loss neighbour from those rows
+        start_ms = meta["covered_ms"] - BATCH_SIZE_MS - aggregates.LOSS_TOLERANCE_MS
+        start_ms = start_ms // aggregates.DAY_MS * aggregates.DAY_MS
+
+    frames = read_region_frames(region, hot, start_ms - aggregates.LOSS_TOLERANCE_MS, window_start_ms, CHART_COLUMNS)
+    frames = {
+        dataset: df[df["time_ms"] >= loss_context_start(dataset, start_ms)] if not df.empty else df
+        for dataset, df in frames.items()
+    }
+    classified = classify_region_frames(region, frames["theft"], frames["fill"], frames["low_fuel"], frames["data_loss"])
+
+    update_aggregates(region, classified, start_ms, 2**62, rebuild)
+    save_aggregate_meta(region, {"fingerprint": fingerprint, "covered_ms": covered_ms})
+
+
+def store_window():
+    now = pd.Timestamp.now() - pd.Timedelta(days=2)
+    now_ms = int((now.normalize() + pd.Timedelta(days=1)).timestamp() * 1000)
+
+    window_start = now.normalize() - pd.Timedelta(days=WINDOW_DAYS)
+    window_start_ms = int(window_start.timestamp() * 1000)
+
+    return now_ms, window_start_ms
+
+
+@contextmanager
+def region_lock(region):
+    # a refresh and a backfill of the same region never write its store at the same time
+    path = CACHE_DIR / region / ".lock"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def run_region_cached(region, url, columns=None, history_start_ms=None):
+    region_dir = CACHE_DIR / region
+    checkpoint_path = region_dir / "checkpoint.json"
+
+
+
+    now_ms, window_start_ms = store_window()
+    with region_lock(region):
+        reset_stale_store(region)
+
+        last_fetched_ms = load_checkpoint(checkpoint_path)
+
+        if last_fetched_ms and last_fetched_ms > window_start_ms:
+            fetch_start_ms = last_fetched_ms + 1
+        else:
+            fetch_start_ms = window_start_ms
+
+        if fetch_start_ms < now_ms:
+            print(f"Fetching {region} delta: {pd.to_datetime(fetch_start_ms, unit='ms')} -> Now")
+            stream_region_to_store(region, url, fetch_start_ms, now_ms, region_dir)
+
+        theft_all = compact_dataset(region, "theft", window_start_ms, (columns or {}).get("theft"))
+        fill_all = compact_dataset(region, "fill", window_start_ms, (columns or {}).get("fill"))
+        low_fuel_all = compact_dataset(region, "low_fuel", window_start_ms, (columns or {}).get("low_fuel"))
+        data_loss_all = compact_dataset(region, "data_loss", window_start_ms, (columns or {}).get("data_loss"))
+
+        hot = {"theft": theft_all, "fill": fill_all, "low_fuel": low_fuel_all, "data_loss": data_loss_all}
+        refresh_aggregates(region, hot, window_start_ms)
+
+        frames = read_region_frames(region, hot, history_start_ms or window_start_ms, window_start_ms, columns)
+    return build_region_outputs(region, frames["theft"], frames["fill"], frames["low_fuel"], frames["data_loss"])
+
+def backfill_progress_path(region):
+    return CACHE_DIR / region / "backfill_progress.jsonl"
+
+
+def load_backfill_progress(path: Path):
+    # one line per finished (dataset, window) of the region
+    progress = {}
+    if not path.exists():
+        return progress
+
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # a line cut short by an interrupted run is fetched again
+                continue
+            progress.setdefault(entry["dataset"], set()).add((entry["start_ms"], entry["end_ms"]))
+    return progress
+
+
+def progress_line(dataset, s, e):
+    return json.dumps({"dataset": dataset, "start_ms": s, "end_ms": e}) + "\n"
+
+
+def backfill(start_ms, end_ms, regions=None, datasets=None, workers=BACKFILL_WORKERS):
+    regions = regions or list(REGIONS)
+    datasets = datasets or list(STREAM_DATASETS)
+    # the hot window belongs to the refresh, which fetches all of it anyway;
+    # backfilled rows only ever land in history/
+    _, window_start_ms = store_window()
+    if end_ms > window_start_ms:
+        print(f"Backfill: stopping at {pd.to_datetime(window_start_ms, unit='ms')}, later dates are kept by the refresh")
+        end_ms = window_start_ms
+    for region in regions:
+        with region_lock(region):
+            reset_stale_store(region)
+    progress = {region: load_backfill_progress(backfill_progress_path(region)) for region in regions}
+    cache = response_cache()
+    closed_before_ms = int(pd.Timestamp.now().timestamp() * 1000) - CLOSED_WINDOW_LAG_MS
+
+    tasks = []
+    for region in regions:
+        for s, e in build_windows(start_ms, end_ms):
+            pending = [d for d in datasets if (s, e) not in progress[region].get(d, set())]
+            if pending:
+                tasks.append((region, s, e, pending))
+
+    print(f"Backfill: {len(tasks)} windows pending across {len(regions)} regions")
+    failed = 0
+
+    # one bounded pool covers every region's windows; rows and progress are written from this thread only
+    progress_logs = {}
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        futures = {
+            ex.submit(
+                fetch_window, s, e, REGIONS[region], False,
+                cache if e <= closed_before_ms else None, pending
+            ): (region, s, e)
+            for region, s, e, pending in tasks
+        }
+
+        for done, fut in enumerate(as_completed(futures), 1):
+            region, s, e = futures[fut]
+            rows, ok = fut.result()
+            if not ok:
+                failed += 1
+
+            # rows only holds the datasets that were fetched, so those are kept
+            # and only the failed ones are retried on the next run
+            if region not in progress_logs:
+                progress_logs[region] = open(backfill_progress_path(region), "a")
+            with region_lock(region):
+                for dataset, dataset_rows in rows.items():
+                    if dataset_rows:
+                        df = normalize_alerts(pd.DataFrame(dataset_rows), dataset)
+                        append_history(region, dataset, df[df["time_ms"] < window_start_ms] if not df.empty else df)
+                    # one write per line, so an interrupted run leaves at most one cut line
+                    progress_logs[region].write(progress_line(dataset, s, e))
+                progress_logs[region].flush()
+
+            if done % 100 == 0:
+                print(f"Backfill: {done}/{len(tasks)} windows")
+
+    for progress_log in progress_logs.values():
+        progress_log.close()
+
+    for region in regions:
+        with region_lock(region):
+            for dataset in datasets:
+                compact_history(region, dataset)
+            # a region whose aggregates are out of date is rebuilt in full on its next refresh
+            if load_aggregate_meta(region).get("fingerprint") == aggregate_fingerprint() and start_ms < end_ms:
+                frames = {
+                    d: read_history(region, d, loss_context_start(d, start_ms), end_ms, CHART_COLUMNS)
+                    for d in STREAM_DATASETS
+                }
+                classified = classify_region_frames(region, frames["theft"], frames["fill"], frames["low_fuel"], frames["data_loss"])
+                update_aggregates(region, classified, start_ms, end_ms)
+
+    cache.reduce_size(RESPONSE_CACHE_BYTES)
+    print(f"Backfill finished: {len(tasks) - failed} windows written, {failed} failed")
+    if failed:
+        print("Rerun the same command to fetch the failed windows")
+
+
+def refresh_all():
 
     end_time = pd.Timestamp.now() - pd.Timedelta(days=2)
     end_time_ms = int((pd.Timestamp(end_time).normalize() + pd.Timedelta(days=1)).timestamp() * 1000)
     start_time = end_time - pd.Timedelta(days=10)
     start_time_ms = int(pd.Timestamp(start_time).normalize().timestamp() * 1000)
 
+    results = {}
     for region, url in REGIONS.items():
         print(f"Processing {region}...")
 
         out = run_region_cached(region, url)
-        print(f"Result {region}: {len(out['theft_daily'])} theft days, {len(out['fill_daily'])} fill days")
+        results[region] = out
+        print(f"Result {region}: {len(out['theft_raw'])} theft alerts, {len(out['fill_raw'])} fill alerts")
 
-    print(f"{region}Data fetcher OK")
\ No newline at end of file
+    print(build_memory_report(results).to_string(index=False))
+
+    print(f"{region}Data fetcher OK")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Refresh the region stores or backfill their history")
+    parser.add_argument("command", nargs="?", choices=["refresh", "backfill"], default="refresh")
+    parser.add_argument("--start", help="first day to backfill (YYYY-MM-DD)")
+    parser.add_argument("--end", help="last day to backfill, inclusive (YYYY-MM-DD)")
+    parser.add_argument("--regions", nargs="+", choices=list(REGIONS))
+    parser.add_argument("--datasets", nargs="+", choices=list(STREAM_DATASETS))
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS)
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        if not args.start or not args.end:
+            parser.error("backfill needs --start and --end")
+        start_ms = int(pd.Timestamp(args.start).normalize().timestamp() * 1000)
+        end_ms = int((pd.Timestamp(args.end).normalize() + pd.Timedelta(days=1)).timestamp() * 1000)
+        backfill(start_ms, end_ms, args.regions, args.datasets, args.workers)
+    else:
+        refresh_all()
@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+DAY_MS = 86400000
+USFS_TAGS = ["usfs", "cusfs"]
+
+
+def to_lazy(df, columns):
+    data = []
+    for col in columns:
+        if df is None or col not in df.columns:
+            continue
+        if col == "usfs":
+            values = [x if isinstance(x, list) else None for x in df[col]]
+            data.append(pl.Series(col, values, dtype=pl.List(pl.Utf8)))
+        elif pd.api.types.is_float_dtype(df[col]):
+            data.append(pl.Series(col, df[col].to_numpy(), nan_to_null=True))
+        else:
+            data.append(pl.Series(col, df[col].to_numpy()))
+    return pl.DataFrame(data).lazy()
+
+
+def daily_series(lf, value_col, agg):
+    daily = (
+        lf.with_columns(((pl.col("time_ms") // DAY_MS) * DAY_MS).alias("day"))
+        .group_by("day")
+        .agg(agg.alias(value_col))
+    )
+    # pandas' daily Grouper emits every day between the first and the last alert;
+    # the null fills turn an empty input into an empty range
+    days = daily.select(
+        pl.int_range(
+            pl.col("day").min().fill_null(0),
+            pl.col("day").max().fill_null(-DAY_MS) + 1,
+            DAY_MS,
+            dtype=pl.Int64,
+        ).alias("day")
+    )
+    return (
+        days.join(daily, on="day", how="left")
+        .with_columns(pl.col(value_col).fill_null(0))
+        .sort("day")
+        .with_columns(
+            (pl.col(value_col).cast(pl.Float64).cum_sum() / pl.int_range(1, pl.len() + 1)).alias("moving average")
+        )
+    )
+
+
+def daily_sum(lf, value_col):
+    return daily_series(lf, value_col, pl.col(value_col).cast(pl.Float64).sum())
+
+
+def daily_count(lf, value_col):
+    return daily_series(lf, value_col, pl.col(value_col).count().cast(pl.Int64))
+
+
+def to_pandas_daily(df, value_col, value_dtype):
+    if df.height == 0:
+        return pd.DataFrame(columns=["time", value_col, "moving average"])
+
+    return pd.DataFrame({
+        "time": pd.to_datetime(df["day"].to_numpy(), unit="ms"),
+        value_col: df[value_col].to_numpy().astype(value_dtype),
+        "moving average": df["moving average"].to_numpy().astype("float64"),
+    })
+
+
+def sum_dtype(df, col):
+    if df is None or col not in df.columns or not pd.api.types.is_numeric_dtype(df[col]):
+        return np.dtype("float64")
+    if pd.api.types.is_float_dtype(df[col]):
+        return df[col].dtype
+    return np.dtype("int64")
+
+
+def build_daily_frames(frames):
+    theft = to_lazy(frames["theft_raw"], ["time_ms", "amount", "probable_variation_max", "usfs"])
+    fill = to_lazy(frames["fill_raw"], ["time_ms", "amount", "probable_variation_max", "usfs"])
+    theft_cev = to_lazy(frames["theft_cev"], ["time_ms", "amount"])
+    fill_cev = to_lazy(frames["fill_cev"], ["time_ms", "amount"])
+    low_fuel = to_lazy(frames["low_fuel_raw"], ["time_ms", "vehicle_id"])
+
+    def has(name, *cols):
+        df = frames[name]
+        return df is not None and not df.empty and all(c in df.columns for c in cols)
+
+    is_usfs = pl.col("usfs").list.eval(pl.element().is_in(USFS_TAGS)).list.any().fill_null(False)
+
+    plans = {}
+    if has("theft_raw", "time_ms", "amount"):
+        plans["theft_daily"] = ("theft_raw", "amount", daily_sum(theft, "amount"))
+    if has("fill_raw", "time_ms", "amount"):
+        plans["fill_daily"] = ("fill_raw", "amount", daily_sum(fill, "amount"))
+    if has("theft_cev", "time_ms", "amount"):
+        plans["theft_cev_daily"] = ("theft_cev", "amount", daily_sum(theft_cev, "amount"))
+    if has("fill_cev", "time_ms", "amount"):
+        plans["fill_cev_daily"] = ("fill_cev", "amount", daily_sum(fill_cev, "amount"))
+    if has("theft_raw", "time_ms", "amount", "usfs"):
+        plans["theft_usfs_daily"] = ("theft_raw", "amount", daily_sum(theft.filter(is_usfs), "amount"))
+    if has("fill_raw", "time_ms", "amount", "usfs"):
+        plans["fill_usfs_daily"] = ("fill_raw", "amount", daily_sum(fill.filter(is_usfs), "amount"))
+    if has("theft_raw", "time_ms", "probable_variation_max"):
+        plans["theft_pv_daily"] = ("theft_raw", "probable_variation_max", daily_sum(
+            theft.filter(pl.col("probable_variation_max").is_not_null()), "probable_variation_max"
+        ))
+    if has("fill_raw", "time_ms", "probable_variation_max"):
+        plans["fill_pv_daily"] = ("fill_raw", "probable_variation_max", daily_sum(
+            fill.filter(pl.col("probable_variation_max").is_not_null()), "probable_variation_max"
+        ))
+    if has("low_fuel_raw", "time_ms", "vehicle_id"):
+        plans["low_fuel_daily"] = ("low_fuel_raw", "vehicle_id", daily_count(low_fuel, "vehicle_id"))
+
+    collected = pl.collect_all([plan for _, _, plan in plans.values()])
+
+    out = {}
+    for (key, (source, value_col, _)), df in zip(plans.items(), collected):
+        value_dtype = np.dtype("int64") if key == "low_fuel_daily" else sum_dtype(frames[source], value_col)
+        out[key] = to_pandas_daily(df, value_col, value_dtype)
+
+    empty_columns = {
+        "theft_daily": "amount", "fill_daily": "amount", "theft_cev_daily": "amount",
+        "fill_cev_daily": "amount", "theft_usfs_daily": "amount", "fill_usfs_daily": "amount",
+        "theft_pv_daily": "probable_variation_max", "fill_pv_daily": "probable_variation_max",
+        "low_fuel_daily": "vehicle_id",
+    }
+    for key, value_col in empty_columns.items():
+        if key not in out:
+            out[key] = pd.DataFrame(columns=["time", value_col, "moving average"])
+
+    return out
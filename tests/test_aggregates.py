@@ -0,0 +1,240 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import aggregates
+
+DAY_MS = aggregates.DAY_MS
+
+
+def test_robust_scores():
+    alerts = pd.DataFrame({
+        "vehicle_id": ["spread"] * 5 + ["tied"] * 5 + ["flat"] * 5 + ["few"] * 2,
+        "amount": [1.0, 2.0, 3.0, 4.0, 5.0, 10.0, 10.0, 10.0, 10.0, 50.0, 7.0, 7.0, 7.0, 7.0, 7.0, 1.0, 100.0],
+    })
+
+    z = aggregates.robust_scores(alerts)["robust_z"].to_numpy()
+
+    # MAD of the spread vehicle is 1
+    assert z[:5] == pytest.approx(0.6745 * np.array([-2.0, -1.0, 0.0, 1.0, 2.0]))
+    # more than half the amounts tie, so the mean absolute deviation (8) is used
+    assert z[9] == pytest.approx(40 / (1.2533 * 8))
+    assert z[10:15] == pytest.approx(np.zeros(5))
+    assert np.isnan(z[15:]).all()
+
+
+def test_slice_range_excludes_the_end():
+    table = pd.DataFrame({"time_ms": [0, 9, 10]})
+
+    assert aggregates.slice_range(table, 0, 10, "time_ms")["time_ms"].tolist() == [0, 9]
+
+
+@pytest.mark.parametrize("n", [50, 1000, 20000])
+def test_hll_estimate_is_within_tolerance(n):
+    values = [f"vehicle-{i}" for i in range(n)]
+
+    estimate = aggregates.hll_estimate(aggregates.hll_registers(values))
+
+    # about 2.3% standard error; 3 sigma keeps the check stable
+    assert abs(estimate - n) <= max(2, 0.07 * n)
+
+
+def test_hll_merge_matches_the_union():
+    left = [str(i) for i in range(0, 6000)]
+    right = [str(i) for i in range(4000, 10000)]
+
+    merged = aggregates.merge_sketches([
+        aggregates.encode_sketch(aggregates.hll_registers(left)),
+        aggregates.encode_sketch(aggregates.hll_registers(right)),
+    ])
+
+    assert np.array_equal(merged, aggregates.hll_registers(left + right))
+    assert abs(aggregates.hll_estimate(merged) - 10000) <= 700
+
+
+def test_hll_sketch_round_trips():
+    registers = aggregates.hll_registers(["a", "b", "c"])
+
+    assert np.array_equal(aggregates.decode_sketch(aggregates.encode_sketch(registers)), registers)
+
+
+def test_replace_range_swaps_only_the_half_open_range():
+    table = pd.DataFrame({"bucket_ms": [0, 10, 20, 30], "value": [1, 2, 3, 4]})
+    fresh = pd.DataFrame({"bucket_ms": [15, 10], "value": [9, 8]})
+
+    out = aggregates.replace_range(table, fresh, 10, 30)
+
+    assert out["bucket_ms"].tolist() == [0, 10, 15, 30]
+    assert out["value"].tolist() == [1, 8, 9, 4]
+
+
+def test_replace_range_with_no_fresh_rows_drops_the_range():
+    table = pd.DataFrame({"bucket_ms": [0, 10, 20], "value": [1, 2, 3]})
+
+    out = aggregates.replace_range(table, pd.DataFrame(columns=["bucket_ms", "value"]), 10, 20)
+
+    assert out["bucket_ms"].tolist() == [0, 20]
+
+
+def test_replace_range_on_empty_table_returns_fresh():
+    fresh = pd.DataFrame({"bucket_ms": [5], "value": [1]})
+
+    out = aggregates.replace_range(None, fresh, 0, 10)
+
+    assert out.equals(fresh)
+
+
+def rollup_tables(frames):
+    hourly = aggregates.hourly_rollup(frames)
+    tables = {"rollup_hour": hourly}
+    tables.update({f"rollup_{level}": aggregates.coarsen(hourly, level) for level in aggregates.ROLLUP_LEVELS})
+    return tables
+
+
+@pytest.mark.parametrize("level", ["hour", "day", "week", "month"])
+def test_rollup_series_matches_raw_rows_with_partial_edges(level):
+    rng = np.random.default_rng(3)
+    start = pd.Timestamp("2026-01-01").value // 10**6
+    time_ms = np.sort(rng.integers(start, start + 70 * DAY_MS, 3000))
+    theft = pd.DataFrame({"time_ms": time_ms, "amount": rng.random(3000) * 100})
+    tables = rollup_tables({"theft_raw": theft})
+
+    # the range starts and ends mid-week and mid-month, so edge buckets are partial
+    range_start, range_end = start + 10 * DAY_MS + 5 * aggregates.HOUR_MS, start + 61 * DAY_MS
+    series = aggregates.rollup_series(tables, "theft", level, range_start, range_end)
+
+    rows = aggregates.slice_range(theft, range_start, range_end, "time_ms")
+    expected = rows.groupby(aggregates.bucket_starts(rows["time_ms"], level))["amount"].sum()
+    got = pd.Series(series["amount"].to_numpy(), index=series["time"].astype("int64") // 10**6)
+    assert got[got != 0].to_numpy() == pytest.approx(expected.to_numpy())
+    assert got.index.isin(expected.index).sum() == len(expected)
+
+
+def test_rollup_series_fills_empty_days_with_zero():
+    low_fuel = pd.DataFrame({"time_ms": [0, 2 * DAY_MS + 5], "vehicle_id": ["a", "b"]})
+    tables = rollup_tables({"low_fuel_raw": low_fuel})
+
+    series = aggregates.rollup_series(tables, "low_fuel", "day", 0, 3 * DAY_MS)
+
+    assert series["vehicle_id"].tolist() == [1, 0, 1]
+    assert series["moving average"].tolist() == pytest.approx([1.0, 0.5, 2 / 3])
+
+
+def test_coarsen_sums_into_calendar_buckets():
+    hourly = pd.DataFrame({
+        "metric": ["theft"] * 3,
+        "bucket_ms": [
+            pd.Timestamp("2026-01-31 23:00").value // 10**6,
+            pd.Timestamp("2026-02-01 00:00").value // 10**6,
+            pd.Timestamp("2026-02-27 10:00").value // 10**6,
+        ],
+        "value": [1.0, 2.0, 3.0],
+        "count": [1, 1, 1],
+    })
+
+    monthly = aggregates.coarsen(hourly, "month")
+
+    assert monthly["value"].tolist() == [1.0, 5.0]
+    assert monthly["count"].tolist() == [1, 2]
+
+
+def test_quantile_sketch_is_within_one_percent():
+    rng = np.random.default_rng(7)
+    values = np.concatenate([rng.lognormal(3, 1, 5000), np.zeros(100)])
+    frames = {"theft_raw": pd.DataFrame({"time_ms": np.full(len(values), 3 * DAY_MS), "amount": values})}
+
+    sketch = aggregates.daily_quantile_sketches(frames).set_index("metric").loc["theft"]
+    got = aggregates.sketch_quantiles(sketch["zeros"], np.array(sketch["bins"]), np.array(sketch["counts"]))
+
+    expected = np.quantile(values, aggregates.QUANTILES, method="lower")
+    for q, value in zip(got, expected):
+        assert abs(q - value) <= aggregates.QUANTILE_ACCURACY * value + 1e-9
+
+
+def test_quantile_sketch_reports_zero_when_most_values_are_zero():
+    frames = {"theft_raw": pd.DataFrame({"time_ms": [0] * 5, "amount": [0.0, 0.0, 0.0, 5.0, 7.0]})}
+
+    sketch = aggregates.daily_quantile_sketches(frames).set_index("metric").loc["theft"]
+
+    p50 = aggregates.sketch_quantiles(sketch["zeros"], np.array(sketch["bins"]), np.array(sketch["counts"]))[0]
+    assert p50 == 0.0
+
+
+def test_quantile_series_merges_daily_sketches():
+    rng = np.random.default_rng(11)
+    time_ms = rng.integers(0, 14 * DAY_MS, 4000)
+    values = rng.lognormal(2, 0.5, 4000)
+    table = aggregates.daily_quantile_sketches({"theft_raw": pd.DataFrame({"time_ms": time_ms, "amount": values})})
+
+    series = aggregates.quantile_series(table, "theft", "week", 0, 14 * DAY_MS)
+
+    # one band per calendar week, each merged from that week's daily sketches
+    for _, row in series.iterrows():
+        start = int(row["time"].value // 10**6)
+        in_week = values[(time_ms >= start) & (time_ms < start + 7 * DAY_MS)]
+        expected = np.quantile(in_week, 0.9, method="lower")
+        assert abs(row["p90"] - expected) <= aggregates.QUANTILE_ACCURACY * expected + 1e-9
+
+
+def test_attach_data_loss_tolerance_is_inclusive_on_both_sides():
+    tol = aggregates.LOSS_TOLERANCE_MS
+    t = 10 * tol
+    alerts = pd.DataFrame({"vehicle_id": ["a", "b", "c", "d"], "time_ms": [t, t, t, t]})
+    data_loss = pd.DataFrame({
+        "vehicle_id": ["a", "b", "c", "c", "x"],
+        "time_ms": [t - tol, t - tol - 1, t + tol, t + tol + 1, t],
+        "data_loss_type": ["Gps", "Gps", "Power", "Power", "Gps"],
+    })
+
+    out = aggregates.attach_data_loss(alerts, data_loss)
+
+    assert out["loss_adjacent"].tolist() == [True, False, True, False]
+    assert out["loss_before_ms"].tolist()[0] == t - tol
+    assert out["loss_after_ms"].tolist()[2] == t + tol
+    assert out["loss_after_type"].tolist()[2] == "Power"
+    assert pd.isna(out["loss_before_ms"].iloc[2])
+
+
+def test_attach_data_loss_keeps_the_alert_order():
+    alerts = pd.DataFrame({"vehicle_id": ["a", "a"], "time_ms": [5 * DAY_MS, 0]})
+    data_loss = pd.DataFrame({"vehicle_id": ["a"], "time_ms": [1], "data_loss_type": ["Gps"]})
+
+    out = aggregates.attach_data_loss(alerts, data_loss)
+
+    assert out["loss_adjacent"].tolist() == [False, True]
+    assert out["loss_after_ms"].tolist()[1] == 1
+
+
+def test_reason_labels_flattens_lists_and_odd_items():
+    col = pd.Series([["a", {"code": "x"}], {"code": "y"}, "b", [], None, [" c ", ""], [3]])
+
+    labels = aggregates.reason_labels(col)
+
+    assert labels.index.tolist() == [0, 0, 1, 2, 3, 4, 5, 5, 6]
+    assert labels.tolist() == [
+        "a", '{"code": "x"}', '{"code": "y"}', "b",
+        aggregates.NO_REASON, aggregates.NO_REASON, "c", aggregates.NO_REASON, "3",
+    ]
+
+
+
+def test_top_n_sums_partials_across_days():
+    partials = pd.DataFrame(
+        [
+            ["theft", "DPL", "vehicle", 0, "a", 10.0, 1],
+            ["theft", "DPL", "vehicle", DAY_MS, "a", 5.0, 2],
+            ["theft", "CEV", "vehicle", 0, "b", 12.0, 1],
+            ["theft", "DPL", "vehicle", 0, "c", 1.0, 1],
+            ["fill", "DPL", "vehicle", 0, "a", 99.0, 1],
+        ],
+        columns=aggregates.LEADER_COLUMNS,
+    )
+
+    out = aggregates.top_n(partials, "theft", "vehicle", n=2)
+
+    assert out["entity_id"].tolist() == ["a", "b"]
+    assert out["value"].tolist() == [15.0, 12.0]
+    assert out["count"].tolist() == [3, 1]
+
+    dpl = aggregates.top_n(partials, "theft", "vehicle", segments=["DPL"])
+    assert dpl["entity_id"].tolist() == ["a", "c"]
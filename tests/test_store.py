@@ -0,0 +1,417 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import aggregates
+import data_fetcher
+
+# above 2**53 a float64 can no longer hold every integer, so type-guessed reads corrupt these ids
+BIG_ID = 2**53 + 1
+DAY_MS = aggregates.DAY_MS
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_fetcher, "CACHE_DIR", tmp_path)
+    return tmp_path
+
+
+def theft_frame(ids, per_vehicle=6):
+    rows = [
+        {
+            "vehicle_id": vehicle_id,
+            "account_id": vehicle_id + 7,
+            "time_ms": DAY_MS + i * 3600 * 1000,
+            "amount": 10.0 + i,
+            "amount_liters": 20.0 + i,
+            "fuel_capacity": 200,
+        }
+        for vehicle_id in ids
+        for i in range(per_vehicle)
+    ]
+    return pd.DataFrame(rows).astype({"vehicle_id": "int64", "account_id": "int64"})
+
+
+def test_theft_scores_keep_large_ids_exact(store):
+    ids = [BIG_ID, BIG_ID + 2]
+    data_fetcher.update_theft_scores("IND", {"theft_raw": theft_frame(ids)}, 0, 2 * DAY_MS)
+
+    scores = data_fetcher.load_theft_scores("IND")
+
+    assert set(scores["vehicle_id"]) == {str(i) for i in ids}
+    assert set(scores["account_id"]) == {str(i + 7) for i in ids}
+    # capacity share is taken from the liters column, not the displayed amount
+    assert scores["capacity_share"].iloc[0] == pytest.approx(20.0 / 200)
+
+
+def test_incremental_theft_scores_match_a_rebuild(store):
+    frame = theft_frame([BIG_ID, BIG_ID + 2], per_vehicle=30)
+    changed = frame.assign(amount=frame["amount"].where(frame["time_ms"] < 2 * DAY_MS, 500.0))
+
+    data_fetcher.update_theft_scores("IND", {"theft_raw": frame}, 0, 3 * DAY_MS)
+    data_fetcher.update_theft_scores("IND", {"theft_raw": changed}, 2 * DAY_MS, 3 * DAY_MS)
+    incremental = data_fetcher.load_theft_scores("IND")
+
+    data_fetcher.update_theft_scores("IND", {"theft_raw": changed}, 0, 3 * DAY_MS, rebuild=True)
+    rebuilt = data_fetcher.load_theft_scores("IND")
+
+    order = ["vehicle_id", "time_ms"]
+    pd.testing.assert_frame_equal(
+        incremental.sort_values(order, ignore_index=True), rebuilt.sort_values(order, ignore_index=True)
+    )
+    assert (incremental["robust_z"] > 0).any()
+
+
+def test_project_units_scales_and_keeps_liters():
+    df = pd.DataFrame({"amount": [10.0, 20.0], "amount_in_kgs": [8.0, 16.0]})
+
+    nasa = data_fetcher.project_units(df, "NASA")
+    fml = data_fetcher.project_units(df, "FML")
+
+    assert nasa["amount"].tolist() == pytest.approx([10 * data_fetcher.GALLON_CONVERSION, 20 * data_fetcher.GALLON_CONVERSION])
+    assert fml["amount"].tolist() == [8.0, 16.0]
+    assert nasa["amount_liters"].tolist() == fml["amount_liters"].tolist() == [10.0, 20.0]
+    assert data_fetcher.project_units(df, "IND") is df
+
+
+def test_stale_store_rebuilds_only_the_hot_tier(store):
+    region_dir = store / "IND"
+    (region_dir / "history" / "theft").mkdir(parents=True)
+    (region_dir / "history" / "theft" / "2026-01.parquet").write_bytes(b"segment")
+    (region_dir / "aggregates").mkdir()
+    for name in ["theft.parquet", "theft.delta.jsonl", "dimensions.jsonl", "backfill_progress.jsonl"]:
+        (region_dir / name).write_text("{}\n")
+    (region_dir / "checkpoint.json").write_text('{"last_fetched_ms": 5, "store_version": 0}')
+
+    data_fetcher.reset_stale_store("IND")
+
+    assert sorted(path.name for path in region_dir.iterdir()) == [
+        "backfill_progress.jsonl", "checkpoint.json", "dimensions.jsonl", "history",
+    ]
+    assert (region_dir / "history" / "theft" / "2026-01.parquet").exists()
+    assert data_fetcher.load_checkpoint(region_dir / "checkpoint.json") is None
+
+
+def test_unreadable_checkpoint_is_an_error(store):
+    (store / "IND").mkdir()
+    (store / "IND" / "checkpoint.json").write_text('{"last_fetched')
+
+    with pytest.raises(RuntimeError):
+        data_fetcher.reset_stale_store("IND")
+    assert (store / "IND" / "checkpoint.json").exists()
+
+
+def window_rows(s, e):
+    # one theft per hour, on a vehicle whose id does not fit a float64 and with no account
+    return [
+        {"time": t, "vehicle_id": BIG_ID, "account_id": None, "amount": 1.0}
+        for t in range(s, e, aggregates.HOUR_MS)
+    ]
+
+
+def test_checkpoint_stops_at_a_failed_window_and_resumes(store, monkeypatch):
+    region_dir = store / "IND"
+    windows = data_fetcher.build_windows(0, 4 * data_fetcher.BATCH_SIZE_MS)
+    failing = {windows[2]}
+
+    def fetch_window(s, e, url, slim=False, cache=None, datasets=None):
+        if (s, e) in failing:
+            return {}, False
+        return {"theft": window_rows(s, e)}, True
+
+    monkeypatch.setattr(data_fetcher, "fetch_window", fetch_window)
+    end_ms = windows[-1][1]
+
+    data_fetcher.stream_region_to_store("IND", "url", 0, end_ms, region_dir)
+    assert data_fetcher.load_checkpoint(region_dir / "checkpoint.json") == windows[1][1]
+
+    failing.clear()
+    data_fetcher.stream_region_to_store("IND", "url", windows[1][1] + 1, end_ms, region_dir)
+    assert data_fetcher.load_checkpoint(region_dir / "checkpoint.json") == end_ms
+
+    theft = data_fetcher.compact_dataset("IND", "theft", 0)
+    assert theft["time_ms"].tolist() == list(range(0, end_ms, aggregates.HOUR_MS))
+    assert set(theft["vehicle_id"]) == {str(BIG_ID)}
+    assert theft["account_id"].isna().all()
+
+
+def test_apply_schema_keeps_ids_exact():
+    df = pd.DataFrame({
+        "vehicle_id": [BIG_ID, BIG_ID + 2],
+        "account_id": [float(2**40), None],
+        "id": ["7", None],
+        "amount": [1.5, 2.5],
+    })
+
+    out = data_fetcher.apply_schema(df)
+
+    assert out["vehicle_id"].tolist() == [str(BIG_ID), str(BIG_ID + 2)]
+    assert out["account_id"].tolist() == [str(2**40), None]
+    assert out["id"].tolist() == ["7", None]
+    assert out["amount"].dtype == "float32"
+
+
+def test_write_table_keeps_mixed_list_columns_as_lists(tmp_path):
+    df = pd.DataFrame({
+        "usfs": [["usfs"], None, "cusfs", ["usfs", "cusfs"]],
+        "ignore_reasons": ["low confidence", ["refuel"], None, []],
+        "type": ["a", "b", "c", "d"],
+    })
+    path = tmp_path / "theft.parquet"
+
+    data_fetcher.write_table(df, path)
+    out = data_fetcher.read_table(path)
+
+    assert out["usfs"].tolist() == [["usfs"], None, ["cusfs"], ["usfs", "cusfs"]]
+    assert out["ignore_reasons"].tolist() == [["low confidence"], ["refuel"], None, []]
+    assert out["usfs"].map(data_fetcher.contains_usfs).sum() == 3
+
+
+def test_write_table_refuses_a_column_it_cannot_store(tmp_path):
+    df = pd.DataFrame({"loss_meta": [{"type": "gps"}, "gps"]})
+
+    with pytest.raises((data_fetcher.pa.ArrowException, ValueError)):
+        data_fetcher.write_table(df, tmp_path / "data_loss.parquet")
+
+
+def test_vehicle_timeline_keeps_neighbouring_large_ids_apart(store):
+    # 2**53 and 2**53 + 1 are the same float64
+    data_fetcher.update_vehicle_index("IND", {"theft": theft_frame([BIG_ID - 1, BIG_ID], per_vehicle=3)}, 0, 2 * DAY_MS)
+
+    timeline = data_fetcher.vehicle_timeline("IND", BIG_ID)
+
+    assert len(timeline) == 3
+    assert timeline["value"].tolist() == [10.0, 11.0, 12.0]
+
+
+def test_vehicle_timeline_keeps_filtered_segments(store):
+    theft = theft_frame([BIG_ID], per_vehicle=4).assign(
+        vehicle_type=["truck", "excavator", "excavator", "truck"],
+        model=["m", "m", "m", data_fetcher.EXCLUDED_MODELS[0]],
+        account_stage=["active", "active", "closed", "active"],
+    )
+    classified = data_fetcher.classify_region_frames("IND", theft, pd.DataFrame(), pd.DataFrame(), pd.DataFrame())
+    data_fetcher.update_vehicle_index("IND", classified, 0, 2 * DAY_MS)
+
+    timeline = data_fetcher.vehicle_timeline("IND", BIG_ID, DAY_MS, DAY_MS + 3 * aggregates.HOUR_MS)
+
+    # the range end is exclusive, so the last alert is left out
+    assert timeline["segment"].tolist() == ["DPL", "CEV", "Closed"]
+    assert data_fetcher.vehicle_timeline("IND", BIG_ID)["segment"].iloc[-1] == "Excluded"
+
+
+def test_backfill_resumes_failed_windows_and_leaves_the_hot_window(store, monkeypatch):
+    _, window_start_ms = data_fetcher.store_window()
+    windows = data_fetcher.build_windows(window_start_ms - 3 * data_fetcher.BATCH_SIZE_MS, window_start_ms)
+    calls = []
+    failing = {windows[1]}
+
+    def fetch_window(s, e, url, slim=False, cache=None, datasets=None):
+        calls.append((s, e))
+        if (s, e) in failing:
+            return {}, False
+        return {"theft": window_rows(s, e)}, True
+
+    monkeypatch.setattr(data_fetcher, "fetch_window", fetch_window)
+    end_ms = window_start_ms + 2 * data_fetcher.BATCH_SIZE_MS
+
+    data_fetcher.backfill(windows[0][0], end_ms, regions=["IND"], datasets=["theft"])
+    assert sorted(calls) == windows
+
+    calls.clear()
+    failing.clear()
+    data_fetcher.backfill(windows[0][0], end_ms, regions=["IND"], datasets=["theft"])
+    assert calls == [windows[1]]
+
+    history = data_fetcher.read_history("IND", "theft", windows[0][0], end_ms)
+    assert history["time_ms"].tolist() == list(range(windows[0][0], window_start_ms, aggregates.HOUR_MS))
+    assert not (store / "IND" / "theft.delta.jsonl").exists()
+
+
+def slim_rows(s, e):
+    return [{"time": s, "vehicle_id": BIG_ID, "account_id": None, "amount": 1.0}]
+
+
+def test_slim_region_stores_rows_when_no_dimensions_come_back(store, monkeypatch):
+    monkeypatch.setitem(data_fetcher.SLIM_QUERY_REGIONS, "IND", True)
+    monkeypatch.setattr(data_fetcher, "fetch_window", lambda s, e, *args, **kwargs: ({"theft": slim_rows(s, e), "fill": []}, True))
+    monkeypatch.setattr(data_fetcher, "get_dimensions", lambda vehicle_ids, url: {"result": {"output": []}})
+
+    data_fetcher.stream_region_to_store("IND", "url", 0, data_fetcher.BATCH_SIZE_MS, store / "IND")
+    theft = data_fetcher.compact_dataset("IND", "theft", 0)
+
+    assert theft["vehicle_id"].tolist() == [str(BIG_ID)]
+    for column in data_fetcher.DIMENSION_ALIASES["theft"].values():
+        assert theft[column].isna().all()
+
+
+def test_dimensions_are_not_refetched_for_large_ids(store, monkeypatch):
+    calls = []
+
+    def get_dimensions(vehicle_ids, url):
+        calls.append(list(vehicle_ids))
+        output = [{"vehicle.id": int(i), **{field: None for field in data_fetcher.DIMENSION_FIELDS}} for i in vehicle_ids]
+        return {"result": {"output": output}}
+
+    monkeypatch.setattr(data_fetcher, "get_dimensions", get_dimensions)
+    path = store / "dimensions.jsonl"
+    ids = [BIG_ID, BIG_ID + 2]
+
+    for _ in range(2):
+        dims = data_fetcher.read_jsonl(path, dtype={"vehicle.id": object})
+        dims, ok = data_fetcher.refresh_dimensions(dims, ids, "url", path)
+        assert ok
+
+    assert len(calls) == 1
+    assert sorted(dims["vehicle.id"]) == [str(BIG_ID), str(BIG_ID + 2)]
+
+
+def test_expired_hot_rows_move_to_monthly_history(store):
+    window_start_ms = pd.Timestamp("2026-02-02").value // 10**6
+    rows = pd.DataFrame({
+        "time": [window_start_ms + i * 12 * aggregates.HOUR_MS for i in range(-8, 4)],
+        "vehicle_id": [BIG_ID] * 12,
+        "amount": [float(i) for i in range(12)],
+    })
+    data_fetcher.append_jsonl(data_fetcher.normalize_alerts(rows, "theft"), store / "IND" / "theft.delta.jsonl")
+
+    hot = data_fetcher.compact_dataset("IND", "theft", window_start_ms)
+
+    assert (hot["time_ms"] >= window_start_ms).all() and len(hot) == 4
+    segments = sorted(path.name for path in (store / "IND" / "history" / "theft").iterdir())
+    assert segments == ["2026-01.parquet", "2026-02.parquet"]
+
+    frames = data_fetcher.read_region_frames("IND", {"theft": hot}, 0, window_start_ms)
+    theft = frames["theft"].sort_values("time_ms")
+    assert theft["amount"].tolist() == [float(i) for i in range(12)]
+    assert set(theft["vehicle_id"]) == {str(BIG_ID)}
+
+    history = data_fetcher.read_history("IND", "theft", window_start_ms - DAY_MS, window_start_ms)
+    assert history["amount"].tolist() == [6.0, 7.0]
+
+
+def test_apply_schema_round_trips_through_the_hot_tier(tmp_path):
+    df = pd.DataFrame({
+        "vehicle_id": [BIG_ID, BIG_ID + 2, BIG_ID],
+        "vehicle_type": ["truck", None, "truck"],
+        "amount": [12.5, 0.25, 100.0],
+        "fuel_level": [0.1, 0.2, None],
+        "time_ms": [1, 2, 3],
+    })
+    schema = data_fetcher.apply_schema(df)
+    path = tmp_path / "theft.parquet"
+
+    data_fetcher.write_table(schema, path)
+    out = data_fetcher.apply_schema(data_fetcher.read_table(path))
+
+    pd.testing.assert_frame_equal(out, schema)
+    assert isinstance(out["vehicle_type"].dtype, pd.CategoricalDtype)
+    assert out["amount"].dtype == "float32"
+    # the narrowed floats stay within the tolerance of the original values
+    assert (out["amount"].astype("float64") - df["amount"]).abs().max() <= data_fetcher.FLOAT32_TOLERANCE
+    assert data_fetcher.legacy_memory_usage(out) > out.memory_usage(deep=True).sum()
+
+
+@pytest.mark.parametrize("dtype", [object, "category"])
+def test_rule_mask_matches_a_row_by_row_lookup(dtype):
+    values = pd.Series(["excavator", None, "truck", "harvester", "excavator", "Excavator"], dtype=dtype)
+    df = pd.DataFrame({"vehicle_type": values})
+
+    mask = data_fetcher.rule_mask(df, "vehicle_type", data_fetcher.MCE_TYPE_SET)
+
+    assert mask.tolist() == [v in data_fetcher.MCE_TYPE_SET for v in values]
+    assert not data_fetcher.rule_mask(df, "model", data_fetcher.EXCLUDED_MODEL_SET).any()
+
+
+def test_rules_are_applied_when_the_rows_are_read(monkeypatch):
+    theft = pd.DataFrame({
+        "time_ms": [0, 1, 2, 3],
+        "vehicle_type": ["truck", "excavator", "excavator", "truck"],
+        "model": ["m", "m", "m", data_fetcher.EXCLUDED_MODELS[0]],
+        "account_stage": ["active", "active", "closed", "active"],
+        "amount": [1.0, 2.0, 3.0, 4.0],
+    })
+
+    split = data_fetcher.split_region_frames("IND", theft, theft.iloc[:0], pd.DataFrame(), pd.DataFrame())
+
+    assert split["theft_raw"]["amount"].tolist() == [1.0]
+    assert split["theft_cev"]["amount"].tolist() == [2.0]
+
+    # a changed rule set reclassifies the same stored rows
+    monkeypatch.setattr(data_fetcher, "CLOSED_STAGE_SET", frozenset())
+    split = data_fetcher.split_region_frames("IND", theft, theft.iloc[:0], pd.DataFrame(), pd.DataFrame())
+
+    assert split["theft_cev"]["amount"].tolist() == [2.0, 3.0]
+
+
+@pytest.mark.parametrize("dataset", ["theft", "fill"])
+def test_merge_and_deduplicate_matches_the_full_merge(dataset):
+    rng = np.random.default_rng(5)
+    old = pd.DataFrame({
+        "id": [str(i) for i in range(400)],
+        "vehicle_id": [str(v) for v in rng.integers(0, 20, 400)],
+        "time_ms": np.sort(rng.integers(0, 10_000, 400)),
+        "amount": rng.random(400),
+    }).drop_duplicates(["vehicle_id", "time_ms"]).reset_index(drop=True)
+    # new rows revise some stored ones, repeat themselves and reach past the stored tail
+    new = pd.concat([old.sample(40, random_state=1).assign(amount=-1.0), old.tail(5).assign(amount=-2.0)])
+    new = pd.concat([new, pd.DataFrame({
+        "id": ["new-1", "new-2"], "vehicle_id": ["1", "2"], "time_ms": [10_500, 9_000], "amount": [3.0, 4.0],
+    })], ignore_index=True)
+    keys = data_fetcher.DEDUP_KEYS[dataset]
+
+    fast = data_fetcher.merge_and_deduplicate(old, new, subset_cols=keys)
+    full = data_fetcher.merge_and_deduplicate_full(old, new, subset_cols=keys)
+
+    assert fast["time_ms"].is_monotonic_increasing
+    order = ["time_ms", "id"]
+    pd.testing.assert_frame_equal(
+        fast.sort_values(order, ignore_index=True), full.sort_values(order, ignore_index=True)
+    )
+
+
+def test_flatten_loss_meta_labels_types_and_keeps_numbers_numeric():
+    df = pd.DataFrame({"loss_meta": [
+        {"type": "gps_loss", "duration": "120", "source": "tracker"},
+        {"type": "", "duration": 30},
+        None,
+        {"duration": 45, "source": 7},
+    ]}, index=[10, 11, 12, 13])
+
+    out = data_fetcher.flatten_loss_meta(df)
+
+    assert out["data_loss_type"].tolist() == ["Gps loss", "Unknown", "Unknown", "Unknown"]
+    assert out["loss_duration"].tolist()[:2] == [120.0, 30.0] and np.isnan(out["loss_duration"].iloc[2])
+    # a field with a non-numeric value keeps its values as they came
+    assert out["loss_source"].tolist()[::3] == ["tracker", 7]
+    assert out.index.tolist() == [10, 11, 12, 13]
+
+
+def test_reason_labels_are_unchanged_by_a_parquet_round_trip(tmp_path):
+    col = pd.Series(["low confidence", ["refuel", "sensor"], None, []])
+    path = tmp_path / "theft.parquet"
+    data_fetcher.write_table(pd.DataFrame({"ignore_reasons": col}), path)
+
+    stored = data_fetcher.read_table(path)["ignore_reasons"]
+
+    assert aggregates.reason_labels(stored).tolist() == aggregates.reason_labels(col).tolist()
+
+
+def test_read_jsonl_keeps_large_ids_exact(store):
+    path = store / "ids.jsonl"
+    data_fetcher.write_jsonl(pd.DataFrame({"vehicle_id": [str(BIG_ID), None], "entity_id": [str(BIG_ID + 2), "x"]}), path)
+
+    df = data_fetcher.read_jsonl(path, dtype=data_fetcher.ID_DTYPES)
+
+    assert df["vehicle_id"].tolist() == [str(BIG_ID), None]
+    assert df["entity_id"].tolist() == [str(BIG_ID + 2), "x"]
+
+
+def test_leaders_keep_large_ids_exact(store):
+    partials = aggregates.daily_leader_partials({"theft_raw": theft_frame([BIG_ID, BIG_ID + 2])})
+    data_fetcher.write_jsonl(partials, data_fetcher.aggregate_dir("IND") / "leaders.jsonl")
+
+    leaders = data_fetcher.load_aggregate_tables("IND")["leaders"]
+    top = aggregates.top_n(leaders, "theft", "vehicle")
+
+    assert set(top["entity_id"]) == {str(BIG_ID), str(BIG_ID + 2)}